@@ -0,0 +1,508 @@
+import asyncio
+import os
+import random
+import re
+import threading
+from glob import glob
+
+import pytest
+
+import tetris_core
+from tetris_archive import Archive, ArchiveWriter, add_replays
+from tetris_core import ACTIONS, DROP, LEFT
+import tetris_ai
+from tetris_ai import AutoPlayer, HintWorker, TranspositionCache, play_random
+import tetris_batch
+from tetris_bitboard import BitBoardGame
+from tetris_replay import Replay, ReplayPlayer, ReplayRecorder, result_of
+import tetris_server
+from tetris_session import Session
+import tetris_snapshot
+from tetris_snapshot import SnapshotEncoder, GameMirror
+from tetris_stats import GameResult, ScoreStore
+
+# Several tests play the same seeded games, so the bot keeps all it has seen
+BOT = AutoPlayer(cache_size=100000)
+REPLAYS = sorted(glob(os.path.join(os.path.dirname(__file__), 'replays', '*.ttr')))
+
+
+class RecordedGame(tetris_core.Game):
+    # Records its own inputs, for games played by tetris_ai's players
+    recorder = None
+
+    def apply(self, action):
+        if self.recorder is not None:
+            self.recorder.record(action)
+        return super().apply(action)
+
+
+def recorded_game(seed, level=1):
+    game = RecordedGame(level, seed, 'bag')
+    game.recorder = ReplayRecorder(game)
+    play_random(game, random.Random(seed), gravity_ticks=3, max_pieces=60)
+    return game
+
+
+def play_inputs(games, seed, pieces=150, garbage_rate=0.002):
+    # The autoplayer's inputs for the first game, some random ones and the
+    # same seeded garbage on every game, one tick at a time
+    rng = random.Random(seed)
+    lead = games[0]
+    piece, actions = None, []
+    while not lead.game_over and lead.pieces_locked < pieces:
+        if piece is not lead.current_piece:
+            piece = lead.current_piece
+            placement = BOT.best_placement(lead)
+            actions = BOT.actions(lead, placement) if placement else [DROP]
+        action = None
+        if rng.random() < 0.03:
+            # A stray input; plan again from wherever it leaves the piece
+            action = rng.choice(ACTIONS[:-1])
+            piece = None
+        elif actions:
+            action = actions.pop(0)
+        garbage = (rng.randrange(1, 3), rng.randrange(tetris_core.GRID_WIDTH)) if rng.random() < garbage_rate else None
+        for game in games:
+            if action is not None:
+                game.apply(action)
+            if garbage is not None:
+                game.add_garbage(*garbage)
+            game.step()
+        yield
+
+
+@pytest.mark.parametrize('path', REPLAYS, ids=os.path.basename)
+def test_saved_replays_reproduce(path):
+    ReplayPlayer(Replay.load(path)).check()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_replay_round_trip(seed):
+    game = recorded_game(seed, level=1 + seed)
+    replay = Replay.from_bytes(game.recorder.finish().to_bytes())
+    assert replay.events == game.recorder.replay.events
+    assert replay.end_tick == game.ticks
+    assert replay.result == result_of(game)
+    played = ReplayPlayer(replay).check()
+    assert played.grid == game.grid
+
+
+def test_replay_applies_inputs_on_its_last_tick():
+    game = RecordedGame(1, 3, 'bag')
+    game.recorder = ReplayRecorder(game)
+    for _ in range(10):
+        game.step()
+    game.apply(LEFT)
+    game.apply(DROP)
+    player = ReplayPlayer(Replay.from_bytes(game.recorder.finish().to_bytes()))
+    assert not player.finished
+    player.check()
+    assert player.finished
+
+
+def test_replay_check_reports_differences():
+    replay = recorded_game(11).recorder.finish()
+    replay.result = replay.result._replace(score=replay.result.score + 1)
+    with pytest.raises(ValueError, match='score'):
+        ReplayPlayer(Replay.from_bytes(replay.to_bytes())).check()
+
+
+def test_replay_without_result_still_loads():
+    replay = recorded_game(12).recorder.finish()
+    replay.result = None
+    loaded = Replay.from_bytes(replay.to_bytes())
+    assert loaded.result is None
+    assert loaded.events == replay.events
+    with pytest.raises(ValueError, match='no saved result'):
+        ReplayPlayer(loaded).check()
+
+
+def test_session_records_and_stores_each_game_once(tmp_path):
+    game = tetris_core.Game()
+    stored = []
+    session = Session(game, tmp_path / 'replays', str(tmp_path / 'scores.db'), on_results=stored.append)
+    session.start(4, seed=5)
+    while session.playing:
+        assert session.input(DROP)
+    assert not session.input(DROP)
+    session.finish()
+    assert len(stored) == 1
+    top, stats = stored[0].result(timeout=10)
+    assert [result.score for result in top] == [game.score]
+    assert stats.games == 1
+
+    # The saved replay plays back the same game; live input is ignored then
+    # and the replay is not stored as a new result
+    path, = (tmp_path / 'replays').iterdir()
+    over = result_of(game)
+    session.start_replay(Replay.load(path))
+    assert not session.input(LEFT)
+    while session.playing:
+        session.advance(1)
+    assert result_of(game) == over
+    assert len(stored) == 1
+    session.close()
+
+
+def test_transposition_cache_evicts_least_recently_used():
+    cache = TranspositionCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the oldest
+    cache.put('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert cache.hit_rate() == 0.75
+    cache.clear()
+    assert len(cache) == 0 and cache.hit_rate() == 0.0
+
+
+def test_autoplayer_cache_does_not_change_its_moves():
+    cached, uncached = AutoPlayer(cache_size=64), AutoPlayer(cache_size=0)
+    game = tetris_core.Game(1, 4, 'bag')
+    for _ in range(40):
+        placement = cached.best_placement(game)
+        assert placement == uncached.best_placement(game)
+        cached.play_piece(game)
+    assert len(cached.cache) == 64
+    assert cached.cache.hits > 0
+
+
+class HeldPlayer:
+    # Holds its first search until released, then answers every search
+    # with the piece it was made for
+    def __init__(self):
+        self.searching = threading.Event()
+        self.release = threading.Event()
+        self.cancelled = []
+
+    def best_placement(self, position, cancelled):
+        if not self.searching.is_set():
+            self.searching.set()
+            self.release.wait(10)
+            self.cancelled.append(cancelled())
+        return position.current_piece.shape_index
+
+
+def test_hint_worker_drops_stale_results():
+    game = tetris_core.Game(1, 8, 'bag')
+    player = HeldPlayer()
+    ready = threading.Event()
+    hints = HintWorker(player, on_ready=ready.set)
+    hints.request(game)
+    assert player.searching.wait(10)
+    # A newer request while the first search runs: that search is told to
+    # stop and whatever it returns is dropped
+    game.apply(DROP)
+    hints.request(game)
+    player.release.set()
+    assert ready.wait(10)
+    assert player.cancelled == [True]
+    assert hints.hint.piece is game.current_piece
+    assert hints.hint.placement == game.current_piece.shape_index
+    hints.close()
+
+
+def test_hint_worker_close_stops_its_thread():
+    game = tetris_core.Game(1, 9, 'bag')
+    ready = threading.Event()
+    hints = HintWorker(AutoPlayer(cache_size=0), on_ready=ready.set)
+    hints.request(game)
+    assert ready.wait(10)
+    assert hints.hint.piece is game.current_piece
+    hints.close()
+    assert not hints.thread.is_alive()
+    assert hints.hint is None
+
+
+def test_replay_playback_keeps_the_games_piece_mode():
+    replay = recorded_game(13).recorder.finish()
+    game = tetris_core.Game(piece_mode='uniform')
+    session = Session(game)
+    session.start_replay(replay)
+    assert game.piece_mode == 'bag'
+    session.start_replay(replay)
+    session.start(1)
+    assert game.piece_mode == 'uniform'
+    assert game.pieces.mode == 'uniform'
+
+
+def test_bag_deals_every_shape_once_per_bag():
+    pieces = tetris_core.PieceGenerator(21, 'bag')
+    dealt = [pieces.next() for _ in range(7 * 50)]
+    for start in range(0, len(dealt), 7):
+        assert sorted(dealt[start:start + 7]) == list(range(7))
+
+
+def test_upcoming_matches_the_pieces_dealt():
+    game = tetris_core.Game(1, 22, 'bag')
+    assert game.upcoming(0) == []
+    upcoming = game.upcoming(10)
+    assert upcoming[0] == game.next_piece.shape_index
+    dealt = []
+    while len(dealt) < 10:
+        game.apply(DROP)
+        dealt.append(game.current_piece.shape_index)
+    assert dealt == upcoming
+
+
+def test_simulation_clock_carries_leftover_time():
+    now = [0.0]
+    clock = tetris_core.SimulationClock(tick=0.01, max_ticks=5, time_source=lambda: now[0])
+    now[0] = 0.025
+    assert clock.advance() == 2
+    assert clock.accumulator == pytest.approx(0.005)
+    now[0] = 0.031
+    assert clock.advance() == 1
+    assert clock.accumulator == pytest.approx(0.001)
+    assert clock.advance(0.009) == 1
+    assert clock.accumulator == pytest.approx(0.0)
+    # A long stall runs at most max_ticks and drops the rest of the backlog
+    now[0] = 1.0
+    assert clock.advance() == 5
+    assert clock.accumulator == 0.0
+    now[0] = 1.004
+    assert clock.advance() == 0
+    clock.reset()
+    assert clock.accumulator == 0.0 and clock.last_time == 1.004
+
+
+@pytest.fixture(scope='module')
+def archived(tmp_path_factory):
+    # Bot games of different lengths from three starting levels, saved as
+    # replays and added to an archive
+    folder = tmp_path_factory.mktemp('archive')
+    bot = AutoPlayer(lookahead=False)
+    paths = []
+    for i in range(9):
+        game = RecordedGame(1 + i % 3, i, 'bag')
+        game.recorder = ReplayRecorder(game)
+        bot.play_paced(game, 4, max_pieces=10 + 20 * i)
+        paths.append(folder / f'{i}.ttr')
+        game.recorder.finish().save(paths[-1])
+    with ArchiveWriter(folder / 'games.tta') as writer:
+        add_replays(writer, paths)
+    return folder / 'games.tta', paths
+
+
+def test_archive_leaderboards(archived):
+    path, replays = archived
+    with Archive(path) as archive:
+        assert len(archive) == len(replays)
+        entries = [archive[index] for index in range(len(archive))]
+        assert [entry.score for entry in entries] == [Replay.load(p).result.score for p in replays]
+        best = sorted(entries, key=lambda entry: entry.score, reverse=True)
+        assert archive.top(5) == best[:5]
+        for level in (1, 2, 3):
+            assert archive.top(5, level) == [entry for entry in best if entry.start_level == level]
+        assert archive.top(5, 4) == []
+
+
+def test_archive_seek_matches_replay(archived):
+    path, replays = archived
+    with Archive(path) as archive:
+        entry = archive[-1]
+        player = archive.player(entry.index)
+        replay = ReplayPlayer(Replay.load(replays[-1]))
+        assert len(player.keyframe_ticks) > 2
+        # Seeking starts from the nearest keyframe, the replay from the start
+        for tick in range(0, entry.ticks + 1, 97):
+            mirror = player.seek(tick)
+            replay.advance_to(tick)
+            game = replay.game
+            assert mirror.grid == game.grid
+            assert (mirror.score, mirror.lines_cleared, mirror.pieces_locked) == \
+                   (game.score, game.lines_cleared, game.pieces_locked)
+            piece, other = mirror.current_piece, game.current_piece
+            assert (piece.shape_index, piece.rotation, piece.x, piece.y) == \
+                   (other.shape_index, other.rotation, other.x, other.y)
+
+
+def test_score_store_results_and_level_stats(tmp_path):
+    path = str(tmp_path / 'scores' / 'scores.db')
+    store = ScoreStore(path)
+    for score, level, player in [(300, 2, 'human'), (900, 2, 'human'), (100, 2, 'human'),
+                                 (5000, 2, 'bot'), (700, 3, 'human')]:
+        store.record(GameResult(0.0, player, level, level, score, score // 100, 10, 30.0, None))
+    top, stats = store.results(2, count=2).result(timeout=10)
+    assert [result.score for result in top] == [900, 300]
+    # Totals kept by the insert trigger, for this player and level only
+    assert stats == (3, 900, 1300 / 3, 13 / 3, 30.0)
+    assert store.results(4).result(timeout=10) == ([], None)
+
+    # close() commits what is still queued and stops the worker
+    store.record(GameResult(0.0, 'human', 2, 2, 2000, 20, 10, 30.0, None))
+    store.close()
+    assert not store.thread.is_alive()
+    store = ScoreStore(path)
+    top, stats = store.results(2).result(timeout=10)
+    assert [result.score for result in top] == [2000, 900, 300, 100]
+    assert (stats.games, stats.best_score) == (4, 2000)
+    store.close()
+
+
+def test_score_store_fails_queries_without_a_database(tmp_path):
+    # The database would go in a directory under a plain file
+    (tmp_path / 'file').write_text('')
+    store = ScoreStore(str(tmp_path / 'file' / 'scores.db'))
+    store.record(GameResult(0.0, 'human', 1, 1, 100, 1, 10, 30.0, None))
+    queued = store.results(1)
+    with pytest.raises(OSError):
+        queued.result(timeout=10)
+    with pytest.raises(OSError):
+        store.results(1).result(timeout=10)
+    store.close()
+    assert not store.thread.is_alive()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_bitboard_matches_grid(seed):
+    level = 1 + seed * 3
+    grid = tetris_core.Game(level, seed, 'bag')
+    bits = BitBoardGame(level, seed, 'bag')
+    for _ in play_inputs((grid, bits), seed):
+        assert result_of(bits) == result_of(grid)
+        assert bits.game_over == grid.game_over
+        piece, other = bits.current_piece, grid.current_piece
+        assert (piece.shape_index, piece.rotation, piece.x, piece.y) == \
+               (other.shape_index, other.rotation, other.x, other.y)
+    # Topping out on garbage ends both games alike
+    for game in (grid, bits):
+        game.add_garbage(tetris_core.GRID_HEIGHT, 0)
+    assert grid.game_over and bits.game_over
+    assert result_of(bits) == result_of(grid)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_snapshots_mirror_the_game(seed):
+    game = tetris_core.Game(1 + seed, seed, 'bag')
+    encoder = SnapshotEncoder(game)
+    mirror = GameMirror()
+    mirror.apply(encoder.keyframe())
+    for tick, _ in enumerate(play_inputs((game,), seed)):
+        if tick % 500 == 499:
+            # A fresh mirror joining from a keyframe
+            mirror = GameMirror()
+            mirror.apply(encoder.keyframe())
+        else:
+            delta = encoder.delta()
+            if delta is not None:
+                assert mirror.apply(delta) == len(delta)
+        assert mirror.grid == game.grid
+        assert (mirror.score, mirror.lines_cleared, mirror.level, mirror.pieces_locked) == \
+               (game.score, game.lines_cleared, game.level, game.pieces_locked)
+        piece, other = mirror.current_piece, game.current_piece
+        assert (piece.shape_index, piece.rotation, piece.x, piece.y) == \
+               (other.shape_index, other.rotation, other.x, other.y)
+        assert mirror.next_piece.shape_index == game.next_piece.shape_index
+        assert mirror.game_over == game.game_over
+    game.add_garbage(tetris_core.GRID_HEIGHT, 0)
+    mirror.apply(encoder.delta())
+    assert game.game_over and mirror.game_over
+    assert mirror.grid == game.grid
+
+
+def test_server_selftest_mirrors_match(capsys):
+    assert asyncio.run(tetris_server.selftest(6, 1.5, versus=1, policy='random', level=1))
+    out = capsys.readouterr().out
+    assert 'mirror mismatches: 0' in out
+    assert int(re.search(r'(\d+) sessions still playing', out).group(1)) > 0
+
+
+def test_mirror_spawns_a_new_piece_for_every_lock():
+    game = tetris_core.Game(1, 5, 'bag')
+    encoder = SnapshotEncoder(game)
+    mirror = GameMirror()
+    mirror.apply(encoder.keyframe())
+    spawns = 0
+    piece = mirror.current_piece
+    for _ in play_inputs((game,), 5, pieces=40):
+        delta = encoder.delta()
+        if delta is not None:
+            mirror.apply(delta)
+        if mirror.current_piece is not piece:
+            piece = mirror.current_piece
+            spawns += 1
+    assert spawns == game.pieces_locked
+
+    # A lock whose new piece looks exactly like the last sends no PIECE,
+    # only counters; it is still a new piece
+    game.pieces_locked += 1
+    delta = encoder.delta()
+    assert delta[0] == tetris_snapshot.COUNTERS
+    mirror.apply(delta)
+    assert mirror.current_piece is not piece
+    assert (mirror.current_piece.shape_index, mirror.current_piece.x, mirror.current_piece.y) == \
+           (piece.shape_index, piece.x, piece.y)
+
+
+def random_rows(rng):
+    # Bitboard rows of a random stack: empty above a random height, each
+    # cell below filled with a random density
+    top = rng.randrange(tetris_core.GRID_HEIGHT + 1)
+    density = rng.random()
+    return [0 if y < top else sum(1 << x for x in range(tetris_core.GRID_WIDTH) if rng.random() < density)
+            for y in range(tetris_core.GRID_HEIGHT)]
+
+
+def test_ai_features_match_a_cell_by_cell_count():
+    rng = random.Random(31)
+    for _ in range(500):
+        rows = random_rows(rng)
+        heights = [next((tetris_core.GRID_HEIGHT - y for y, row in enumerate(rows) if row >> x & 1), 0)
+                   for x in range(tetris_core.GRID_WIDTH)]
+        filled = sum(bin(row).count('1') for row in rows)
+        bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+        assert tetris_ai.features(rows) == (sum(heights), sum(heights) - filled, bumpiness)
+
+
+def test_numpy_features_match_the_autoplayer():
+    tetris_numpy = pytest.importorskip('tetris_numpy')
+    rng = random.Random(32)
+    rows = [random_rows(rng) for _ in range(500)]
+    lines = [rng.randrange(5) for _ in rows]
+    boards = tetris_numpy.from_rows(rows)
+    assert (tetris_numpy.to_rows(boards) == rows).all()
+    height, holes, bumpiness = tetris_numpy.features(boards)
+    assert list(zip(height.tolist(), holes.tolist(), bumpiness.tolist())) == \
+           [tetris_ai.features(board) for board in rows]
+    assert tetris_numpy.evaluate(boards, lines).tolist() == pytest.approx(
+        [tetris_ai.evaluate(board, count, tetris_ai.DEFAULT_WEIGHTS) for board, count in zip(rows, lines)])
+
+
+def test_batch_results_depend_only_on_the_seeds():
+    def games(**options):
+        rows = {}
+        results = tetris_batch.run(6, [1, 3], 'bot', seed=40, max_pieces=25,
+                                   on_games=lambda level, block: rows.update(
+                                       ((level, game[0]), game) for game in block), **options)
+        return results, rows
+
+    # Different sharding, same games
+    results, rows = games(workers=2, block=2)
+    again, rows_again = games(workers=1, block=6)
+    assert rows == rows_again
+    assert sorted(rows) == [(level, seed) for level in (1, 3) for seed in range(40, 46)]
+    # Each one the same as playing it alone
+    for (level, seed), game in rows.items():
+        assert game[1:] == tetris_batch.play(seed, level, 'bot', 25, 6, 'bag')
+    for level in (1, 3):
+        for name, stats in results[level].items():
+            other = again[level][name]
+            assert (stats.count, stats.min, stats.max) == (other.count, other.min, other.max)
+            assert stats.mean == pytest.approx(other.mean)
+            assert stats.stdev == pytest.approx(other.stdev)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_incremental_counters_match_a_recount(seed):
+    # Line clears and garbage both move every row
+    game = tetris_core.Game(1 + seed, seed, 'bag')
+    start_lines = game.lines_cleared
+    for _ in play_inputs((game,), seed, pieces=100, garbage_rate=0.03):
+        counters = (game.row_counts[:], game.heights[:], game.filled_cells, game.holes)
+        game.recount()
+        assert counters == (game.row_counts, game.heights, game.filled_cells, game.holes)
+    assert game.lines_cleared > start_lines
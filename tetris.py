@@ -1,17 +1,23 @@
-import pygame
-import random
+import argparse
+import os
 import time
+import pygame
+from collections import OrderedDict
+
+import tetris_core
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, ROTATIONS, EMPTY
+from tetris_core import LEFT, RIGHT, DOWN, ROTATE, DROP
+from tetris_replay import Replay
+from tetris_session import Session
 
-# Initialize pygame
-pygame.init()
-pygame.font.init()
+# tetris_startup.py sets this to time a cold start: main() prints the wall
+# time once the first frame is on screen and exits
+STARTUP_PROBE = 'TETRIS_STARTUP_PROBE'
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 700
 BLOCK_SIZE = 30
-GRID_WIDTH = 10
-GRID_HEIGHT = 20
 GRID_X = (SCREEN_WIDTH - GRID_WIDTH * BLOCK_SIZE) // 2
 GRID_Y = SCREEN_HEIGHT - (GRID_HEIGHT * BLOCK_SIZE) - 50
 
@@ -27,155 +33,134 @@ MAGENTA = (255, 0, 255)
 YELLOW = (255, 255, 0)
 ORANGE = (255, 165, 0)
 
-# Tetrimino shapes
-SHAPES = [
-    [[1, 1, 1, 1]],  # I
-    [[1, 1], [1, 1]],  # O
-    [[1, 1, 1], [0, 1, 0]],  # T
-    [[1, 1, 1], [1, 0, 0]],  # J
-    [[1, 1, 1], [0, 0, 1]],  # L
-    [[0, 1, 1], [1, 1, 0]],  # S
-    [[1, 1, 0], [0, 1, 1]]   # Z
-]
-
-# Colors for each shape
+# Colors for each shape, indexed by shape_index (grid cells store shape_index + 1)
 SHAPE_COLORS = [CYAN, YELLOW, MAGENTA, BLUE, ORANGE, GREEN, RED]
 
-# Create the game window
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Tetris")
-
-# Game clock
-clock = pygame.time.Clock()
+# Font sizes by role; SysFont scans system fonts, so each is created only once
+FONT_SIZES = {
+    'title': 48,
+    'menu': 36,
+    'hud': 24,
+    'small': 20,
+}
 
-class Tetrimino:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.shape_index = random.randint(0, len(SHAPES) - 1)
-        self.shape = SHAPES[self.shape_index]
-        self.color = SHAPE_COLORS[self.shape_index]
-        self.rotation = 0
-    
-    def rotate(self):
-        # Transpose the matrix and reverse each row for clockwise rotation
-        rows = len(self.shape)
-        cols = len(self.shape[0])
-        rotated = [[0 for _ in range(rows)] for _ in range(cols)]
-        
-        for r in range(rows):
-            for c in range(cols):
-                rotated[c][rows - 1 - r] = self.shape[r][c]
-        
-        # Check if rotation is valid
-        if not self.collision(0, 0, rotated):
-            self.shape = rotated
+class TextCache:
+    # Fonts built once plus an LRU cache of rendered text surfaces keyed by
+    # (font, text, color), so unchanged labels are never re-rendered
+    def __init__(self, max_size=128):
+        self.fonts = {name: pygame.font.SysFont('Arial', size) 
+                      for name, size in FONT_SIZES.items()}
+        self.surfaces = OrderedDict()
+        self.max_size = max_size
     
-    def collision(self, dx=0, dy=0, shape=None):
-        if shape is None:
-            shape = self.shape
-        
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    pos_x = self.x + x + dx
-                    pos_y = self.y + y + dy
-                    
-                    # Check if out of bounds
-                    if (pos_x < 0 or pos_x >= GRID_WIDTH or 
-                        pos_y >= GRID_HEIGHT or 
-                        (pos_y >= 0 and grid[pos_y][pos_x])):
-                        return True
-        return False
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        
+        surface = self.fonts[font].render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
 
-class Game:
-    def __init__(self):
+# Screen areas repainted independently by the dirty-rectangle renderer
+GRID_RECT = pygame.Rect(GRID_X, GRID_Y, GRID_WIDTH * BLOCK_SIZE, GRID_HEIGHT * BLOCK_SIZE)
+HUD_RECT = pygame.Rect(40, 40, GRID_X - 50, 130)
+NEXT_BOX_RECT = pygame.Rect(SCREEN_WIDTH - 150, 50, 120, 120)
+PROFILE_RECT = pygame.Rect(10, SCREEN_HEIGHT - 170, GRID_X - 20, 160)
+# Below the game over message, whose second line reaches past the grid's
+# right edge and ends around y=460
+RESULTS_RECT = pygame.Rect(GRID_X + GRID_WIDTH * BLOCK_SIZE + 20, 465,
+                           SCREEN_WIDTH - GRID_X - GRID_WIDTH * BLOCK_SIZE - 30, SCREEN_HEIGHT - 470)
+PROFILE_REFRESH = 0.5  # Seconds between profiling overlay updates
+
+# Keys that map to player actions during play
+KEY_ACTIONS = {
+    pygame.K_LEFT: LEFT,
+    pygame.K_RIGHT: RIGHT,
+    pygame.K_DOWN: DOWN,
+    pygame.K_UP: ROTATE,
+    pygame.K_SPACE: DROP,
+}
+
+class Game(tetris_core.Game):
+    def __init__(self, screen, piece_mode='uniform', record_dir=None, bot=False, scores_path=False, hint=False):
+        self.screen = screen
         self.in_level_selection = True
         self.selected_level = 1
-        self.reset()
+        self.background = None
+        self.text = TextCache()
+        self.clock = tetris_core.SimulationClock()
+        self.bot = None
+        if bot:
+            # Imported on demand; building its tables is startup time
+            from tetris_ai import AutoPlayer
+            self.bot = AutoPlayer()
+        self.bot_piece = None
+        self.bot_actions = []
+        # Replays, results and hints; scores_path False keeps no results,
+        # None uses the default location
+        self.session = Session(self, record_dir, scores_path, 'human' if self.bot is None else 'bot')
+        super().__init__(self.selected_level, piece_mode=piece_mode)
+        if hint:
+            self.session.toggle_hints()
     
-    def reset(self, level=None):
-        global grid
-        grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-        self.current_piece = self.new_piece()
-        self.next_piece = self.new_piece()
-        self.game_over = False
-        self.score = 0
-        self.level = level if level is not None else self.selected_level
-        self.lines_cleared = (self.level - 1) * 10  # Set lines cleared based on level
-        self.fall_speed = max(0.05, 0.5 - (self.level - 1) * 0.05)  # Adjust speed based on level
-        self.last_fall_time = time.time()
+    def reset(self, level=None, seed=None):
+        super().reset(level if level is not None else self.selected_level, seed)
+        self.clock.reset()
+        self.invalidate()
     
-    def new_piece(self):
-        return Tetrimino(GRID_WIDTH // 2 - 1, 0)
+    def play_replay(self, replay):
+        self.in_level_selection = False
+        self.session.start_replay(replay)
     
-    def lock_piece(self):
-        for y, row in enumerate(self.current_piece.shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    if self.current_piece.y + y < 0:
-                        self.game_over = True
-                        return
-                    grid[self.current_piece.y + y][self.current_piece.x + x] = self.current_piece.color
-        
-        self.clear_lines()
-        self.current_piece = self.next_piece
-        self.next_piece = self.new_piece()
-        
-        # Check if the new piece can be placed
-        if self.current_piece.collision():
-            self.game_over = True
-    
-    def clear_lines(self):
-        lines_to_clear = []
-        for y in range(GRID_HEIGHT):
-            if all(grid[y]):
-                lines_to_clear.append(y)
-        
-        if lines_to_clear:
-            for line in lines_to_clear:
-                del grid[line]
-                grid.insert(0, [0 for _ in range(GRID_WIDTH)])
-            
-            self.lines_cleared += len(lines_to_clear)
-            self.score += (len(lines_to_clear) ** 2) * 100
-            self.level = self.lines_cleared // 10 + 1
-            self.fall_speed = max(0.05, 0.5 - (self.level - 1) * 0.05)
-    
-    def move(self, dx, dy):
-        if not self.current_piece.collision(dx, dy):
-            self.current_piece.x += dx
-            self.current_piece.y += dy
-            return True
-        return False
-    
-    def drop(self):
-        while self.move(0, 1):
-            pass
-        self.lock_piece()
+    def invalidate(self):
+        # Force the next draw call to repaint the whole screen
+        self.drawn_cells = None
+        self.drawn_hud = None
+        self.drawn_next = None
+        self.drawn_game_over = False
+        self.drawn_results = False
+        self.drawn_level = None
     
     def update(self):
-        current_time = time.time()
-        if current_time - self.last_fall_time > self.fall_speed:
-            if not self.move(0, 1):
-                self.lock_piece()
-            self.last_fall_time = current_time
+        # Run the simulation ticks that came due since the last frame
+        ticks = self.clock.advance()
+        if self.bot is not None and self.session.player is None:
+            self.bot_step()
+        self.session.advance(ticks)
+    
+    def bot_step(self):
+        # Plan once per piece, then play one input per frame so it is visible
+        if self.bot_piece is not self.current_piece:
+            self.bot_piece = self.current_piece
+            placement = self.bot.best_placement(self)
+            self.bot_actions = self.bot.actions(self, placement) if placement else [DROP]
+        if self.bot_actions:
+            self.session.input(self.bot_actions.pop(0))
     
     def draw_level_selection(self):
+        # The menu only changes when the selected level does
+        if self.drawn_level == self.selected_level:
+            return []
+        self.drawn_level = self.selected_level
+        self.drawn_cells = None
+        
         # Draw background
-        screen.fill(BLACK)
+        self.screen.fill(BLACK)
         
         # Draw title
-        font_title = pygame.font.SysFont('Arial', 48)
-        title_text = font_title.render("TETRIS", True, WHITE)
-        screen.blit(title_text, 
+        title_text = self.text.render('title', "TETRIS", WHITE)
+        self.screen.blit(title_text, 
                    (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 
                     100))
         
         # Draw level selection instructions
-        font = pygame.font.SysFont('Arial', 36)
-        select_text = font.render("Select Starting Level (1-10):", True, WHITE)
-        screen.blit(select_text, 
+        select_text = self.text.render('menu', "Select Starting Level (1-10):", WHITE)
+        self.screen.blit(select_text, 
                    (SCREEN_WIDTH // 2 - select_text.get_width() // 2, 
                     200))
         
@@ -191,13 +176,13 @@ class Game:
             button_y = 300
             button_color = CYAN if i == self.selected_level else GRAY
             
-            pygame.draw.rect(screen, button_color, 
+            pygame.draw.rect(self.screen, button_color, 
                              (button_x, button_y, button_width, button_height))
-            pygame.draw.rect(screen, WHITE, 
+            pygame.draw.rect(self.screen, WHITE, 
                              (button_x, button_y, button_width, button_height), 2)
             
-            level_num = font.render(str(i), True, BLACK if i == self.selected_level else WHITE)
-            screen.blit(level_num, 
+            level_num = self.text.render('menu', str(i), BLACK if i == self.selected_level else WHITE)
+            self.screen.blit(level_num, 
                        (button_x + button_width // 2 - level_num.get_width() // 2, 
                         button_y + button_height // 2 - level_num.get_height() // 2))
         
@@ -207,29 +192,30 @@ class Game:
         start_button_x = (SCREEN_WIDTH - start_button_width) // 2
         start_button_y = 400
         
-        pygame.draw.rect(screen, GREEN, 
+        pygame.draw.rect(self.screen, GREEN, 
                          (start_button_x, start_button_y, 
                           start_button_width, start_button_height))
-        pygame.draw.rect(screen, WHITE, 
+        pygame.draw.rect(self.screen, WHITE, 
                          (start_button_x, start_button_y, 
                           start_button_width, start_button_height), 2)
         
-        start_text = font.render("START", True, BLACK)
-        screen.blit(start_text, 
+        start_text = self.text.render('menu', "START", BLACK)
+        self.screen.blit(start_text, 
                    (start_button_x + start_button_width // 2 - start_text.get_width() // 2, 
                     start_button_y + start_button_height // 2 - start_text.get_height() // 2))
         
         # Draw controls instructions
-        font_small = pygame.font.SysFont('Arial', 20)
-        controls_text1 = font_small.render("Controls: Arrow Keys to move, Up to rotate, Space to drop", True, WHITE)
-        controls_text2 = font_small.render("Press R to restart after game over", True, WHITE)
+        controls_text1 = self.text.render('small', "Controls: Arrow Keys to move, Up to rotate, Space to drop", WHITE)
+        controls_text2 = self.text.render('small', "Press R to restart after game over", WHITE)
         
-        screen.blit(controls_text1, 
+        self.screen.blit(controls_text1, 
                    (SCREEN_WIDTH // 2 - controls_text1.get_width() // 2, 
                     500))
-        screen.blit(controls_text2, 
+        self.screen.blit(controls_text2, 
                    (SCREEN_WIDTH // 2 - controls_text2.get_width() // 2, 
                     530))
+        
+        return [self.screen.get_rect()]
     
     def handle_level_selection_click(self, pos):
         button_width = 50
@@ -257,14 +243,15 @@ class Game:
         
         if start_button_rect.collidepoint(pos):
             self.in_level_selection = False
-            self.reset(self.selected_level)
+            self.session.start(self.selected_level)
     
-    def draw_grid(self):
-        # Draw background
-        screen.fill(BLACK)
+    def render_background(self):
+        # Static parts of the game screen, rendered once and reused to erase
+        background = pygame.Surface(self.screen.get_size()).convert()
+        background.fill(BLACK)
         
         # Draw grid border
-        pygame.draw.rect(screen, WHITE, 
+        pygame.draw.rect(background, WHITE, 
                          (GRID_X - 2, GRID_Y - 2, 
                           GRID_WIDTH * BLOCK_SIZE + 4, 
                           GRID_HEIGHT * BLOCK_SIZE + 4), 2)
@@ -272,106 +259,204 @@ class Game:
         # Draw grid cells
         for y in range(GRID_HEIGHT):
             for x in range(GRID_WIDTH):
-                pygame.draw.rect(screen, GRAY, 
+                pygame.draw.rect(background, GRAY, 
                                  (GRID_X + x * BLOCK_SIZE, 
                                   GRID_Y + y * BLOCK_SIZE, 
                                   BLOCK_SIZE, BLOCK_SIZE), 1)
         
-        # Draw locked pieces
-        for y in range(GRID_HEIGHT):
-            for x in range(GRID_WIDTH):
-                if grid[y][x]:
-                    pygame.draw.rect(screen, grid[y][x], 
-                                     (GRID_X + x * BLOCK_SIZE, 
-                                      GRID_Y + y * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                     (GRID_X + x * BLOCK_SIZE, 
-                                      GRID_Y + y * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE), 1)
-        
-        # Draw current piece
-        for y, row in enumerate(self.current_piece.shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    pygame.draw.rect(screen, self.current_piece.color, 
-                                     (GRID_X + (self.current_piece.x + x) * BLOCK_SIZE, 
-                                      GRID_Y + (self.current_piece.y + y) * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                     (GRID_X + (self.current_piece.x + x) * BLOCK_SIZE, 
-                                      GRID_Y + (self.current_piece.y + y) * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE), 1)
+        # Draw next piece preview box
+        pygame.draw.rect(background, WHITE, NEXT_BOX_RECT, 2)
+        
+        next_text = self.text.render('hud', "Next:", WHITE)
+        background.blit(next_text, (NEXT_BOX_RECT.x, NEXT_BOX_RECT.y - 30))
+        return background
+    
+    def draw_block(self, color, rect):
+        pygame.draw.rect(self.screen, color, rect)
+        pygame.draw.rect(self.screen, WHITE, rect, 1)
+    
+    def draw_grid(self):
+        # Repaint only what changed since the last call and return the dirty
+        # rectangles for pygame.display.update
+        if self.background is None:
+            self.background = self.render_background()
+        
+        dirty = []
+        if self.drawn_cells is None:
+            self.screen.blit(self.background, (0, 0))
+            dirty.append(self.screen.get_rect())
+            self.drawn_cells = [EMPTY] * (GRID_WIDTH * GRID_HEIGHT)
+        
+        # Locked blocks plus the falling piece, one value per cell
+        cells = [value for row in self.grid for value in row]
+        piece = self.current_piece
+        for x, y in piece.cells:
+            if piece.y + y >= 0:
+                cells[(piece.y + y) * GRID_WIDTH + piece.x + x] = piece.shape_index + 1
+        
+        # Ghost outline of the hinted placement, once the worker has found
+        # it; negative values mark outline cells
+        hints = self.session.hints
+        hint = hints.hint if hints is not None else None
+        if hint is not None and hint.piece is piece:
+            placement = hint.placement
+            for x, y in ROTATIONS[piece.shape_index][placement.rotation].cells:
+                i = (placement.y + y) * GRID_WIDTH + placement.x + x
+                if placement.y + y >= 0 and not cells[i]:
+                    cells[i] = -(piece.shape_index + 1)
+        
+        # Draw cells that changed
+        drawn = self.drawn_cells
+        changed = []
+        for i, value in enumerate(cells):
+            if value != drawn[i]:
+                y, x = divmod(i, GRID_WIDTH)
+                rect = pygame.Rect(GRID_X + x * BLOCK_SIZE, GRID_Y + y * BLOCK_SIZE, 
+                                   BLOCK_SIZE, BLOCK_SIZE)
+                if value > 0:
+                    self.draw_block(SHAPE_COLORS[value - 1], rect)
+                else:
+                    self.screen.blit(self.background, rect, rect)
+                    if value < 0:
+                        pygame.draw.rect(self.screen, SHAPE_COLORS[-value - 1], rect, 2)
+                changed.append(rect)
+        self.drawn_cells = cells
+        if changed:
+            dirty.append(changed[0].unionall(changed))
         
         # Draw next piece preview
-        self.draw_next_piece()
+        if self.drawn_next is not self.next_piece:
+            self.drawn_next = self.next_piece
+            dirty.append(self.draw_next_piece())
         
         # Draw score and level
-        font = pygame.font.SysFont('Arial', 24)
-        score_text = font.render(f"Score: {self.score}", True, WHITE)
-        level_text = font.render(f"Level: {self.level}", True, WHITE)
-        lines_text = font.render(f"Lines: {self.lines_cleared}", True, WHITE)
-        
-        screen.blit(score_text, (50, 50))
-        screen.blit(level_text, (50, 90))
-        screen.blit(lines_text, (50, 130))
+        hud = (self.score, self.level, self.lines_cleared)
+        if self.drawn_hud != hud:
+            self.drawn_hud = hud
+            self.screen.blit(self.background, HUD_RECT, HUD_RECT)
+            
+            score_text = self.text.render('hud', f"Score: {self.score}", WHITE)
+            level_text = self.text.render('hud', f"Level: {self.level}", WHITE)
+            lines_text = self.text.render('hud', f"Lines: {self.lines_cleared}", WHITE)
+            
+            self.screen.blit(score_text, (50, 50))
+            self.screen.blit(level_text, (50, 90))
+            self.screen.blit(lines_text, (50, 130))
+            dirty.append(HUD_RECT)
         
         # Draw game over message
-        if self.game_over:
-            font = pygame.font.SysFont('Arial', 48)
-            game_over_text = font.render("GAME OVER", True, RED)
-            restart_text = font.render("Press R to restart", True, WHITE)
+        if self.game_over and not self.drawn_game_over:
+            self.drawn_game_over = True
+            game_over_text = self.text.render('title', "GAME OVER", RED)
+            restart_text = self.text.render('title', "Press R to restart", WHITE)
             
-            screen.blit(game_over_text, 
+            dirty.append(self.screen.blit(game_over_text, 
                        (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, 
-                        SCREEN_HEIGHT // 2 - game_over_text.get_height() // 2))
-            screen.blit(restart_text, 
+                        SCREEN_HEIGHT // 2 - game_over_text.get_height() // 2)))
+            dirty.append(self.screen.blit(restart_text, 
                        (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, 
-                        SCREEN_HEIGHT // 2 + game_over_text.get_height()))
-    
-    def draw_next_piece(self):
-        # Draw next piece preview box
-        next_box_x = SCREEN_WIDTH - 150
-        next_box_y = 50
-        next_box_width = 120
-        next_box_height = 120
+                        SCREEN_HEIGHT // 2 + game_over_text.get_height())))
         
-        pygame.draw.rect(screen, WHITE, 
-                         (next_box_x, next_box_y, 
-                          next_box_width, next_box_height), 2)
+        # Leaderboard, as soon as the score store has answered
+        results = self.session.results
+        if results is not None and results.done() and not self.drawn_results:
+            self.drawn_results = True
+            if results.exception() is None:
+                dirty.append(self.draw_results(*results.result()))
         
-        font = pygame.font.SysFont('Arial', 24)
-        next_text = font.render("Next:", True, WHITE)
-        screen.blit(next_text, (next_box_x, next_box_y - 30))
+        return dirty
+    
+    def draw_results(self, top, stats):
+        self.screen.blit(self.background, RESULTS_RECT, RESULTS_RECT)
+        x, y = RESULTS_RECT.topleft
+        title = self.text.render('hud', f"Best from level {self.start_level}", WHITE)
+        self.screen.blit(title, (x, y))
+        y += title.get_height() + 6
+        font = self.text.fonts['small']
+        for rank, result in enumerate(top, 1):
+            # This game's entry, if it made the list, in yellow
+            color = YELLOW if result.seed == self.seed and result.score == self.score else WHITE
+            self.screen.blit(font.render(f"{rank}. {result.score}", True, color), (x, y))
+            y += font.get_linesize()
+        if stats is not None:
+            y += 6
+            for line in (f"Games: {stats.games}", f"Avg score: {stats.mean_score:.0f}",
+                         f"Avg lines: {stats.mean_lines:.1f}"):
+                self.screen.blit(font.render(line, True, GRAY), (x, y))
+                y += font.get_linesize()
+        return RESULTS_RECT
+    
+    def draw_profile(self, profiler):
+        # Profiling overlay in the empty bottom-left corner
+        self.screen.fill(BLACK, PROFILE_RECT)
+        font = self.text.fonts['small']
+        y = PROFILE_RECT.y
+        for line in profiler.summary():
+            # Numbers change every refresh, so bypass the text cache
+            self.screen.blit(font.render(line, True, GREEN), (PROFILE_RECT.x, y))
+            y += font.get_linesize()
+        return PROFILE_RECT
+    
+    def draw_next_piece(self):
+        # Restore the empty next piece preview box
+        self.screen.blit(self.background, NEXT_BOX_RECT, NEXT_BOX_RECT)
         
         # Calculate center position for the next piece
-        shape_width = len(self.next_piece.shape[0]) * BLOCK_SIZE
-        shape_height = len(self.next_piece.shape) * BLOCK_SIZE
+        rotation = ROTATIONS[self.next_piece.shape_index][self.next_piece.rotation]
+        shape_width = rotation.width * BLOCK_SIZE
+        shape_height = rotation.height * BLOCK_SIZE
         
-        center_x = next_box_x + (next_box_width - shape_width) // 2
-        center_y = next_box_y + (next_box_height - shape_height) // 2
+        center_x = NEXT_BOX_RECT.x + (NEXT_BOX_RECT.width - shape_width) // 2
+        center_y = NEXT_BOX_RECT.y + (NEXT_BOX_RECT.height - shape_height) // 2
         
         # Draw the next piece
-        for y, row in enumerate(self.next_piece.shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    pygame.draw.rect(screen, self.next_piece.color, 
-                                     (center_x + x * BLOCK_SIZE, 
-                                      center_y + y * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                     (center_x + x * BLOCK_SIZE, 
-                                      center_y + y * BLOCK_SIZE, 
-                                      BLOCK_SIZE, BLOCK_SIZE), 1)
+        for x, y in rotation.cells:
+            self.draw_block(SHAPE_COLORS[self.next_piece.shape_index], 
+                            (center_x + x * BLOCK_SIZE, 
+                             center_y + y * BLOCK_SIZE, 
+                             BLOCK_SIZE, BLOCK_SIZE))
+        return NEXT_BOX_RECT
 
-def main():
-    game = Game()
+def main(record_dir=None, replay_path=None, profile_path=None, bot=False, scores_path=None, hint=False):
+    # Only the modules the game uses; pygame.init() would also start audio
+    # and joystick support, which costs startup time
+    pygame.display.init()
+    pygame.font.init()
+    
+    # Create the game window
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Tetris")
+    
+    # Game clock
+    clock = pygame.time.Clock()
+    
+    # Results go to SQLite on the store's own thread; scores_path False
+    # keeps none, None uses the default location. A startup probe never
+    # gets to a game over, so it keeps none either.
+    startup_probe = os.environ.get(STARTUP_PROBE)
+    if startup_probe:
+        scores_path = False
+    game = Game(screen, record_dir=record_dir, bot=bot, scores_path=scores_path, hint=hint)
+    if replay_path is not None:
+        game.play_replay(Replay.load(replay_path))
+    
+    # Per-phase frame timings, only when profiling was asked for
+    profiler = None
+    if profile_path:
+        from tetris_profile import FrameProfiler
+        profiler = FrameProfiler()
+    next_overlay = 0
     running = True
     
     while running:
+        if profiler:
+            profiler.start_frame()
+        
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                game.invalidate()
             
             if game.in_level_selection:
                 if event.type == pygame.MOUSEBUTTONDOWN:
@@ -383,34 +468,68 @@ def main():
                         game.selected_level += 1
                     elif event.key == pygame.K_RETURN or event.key == pygame.K_SPACE:
                         game.in_level_selection = False
-                        game.reset(game.selected_level)
-            elif not game.game_over:
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        game.move(-1, 0)
-                    elif event.key == pygame.K_RIGHT:
-                        game.move(1, 0)
-                    elif event.key == pygame.K_DOWN:
-                        game.move(0, 1)
-                    elif event.key == pygame.K_UP:
-                        game.current_piece.rotate()
-                    elif event.key == pygame.K_SPACE:
-                        game.drop()
+                        game.session.start(game.selected_level)
+            elif game.session.playing:
+                if event.type == pygame.KEYDOWN and event.key in KEY_ACTIONS:
+                    game.session.input(KEY_ACTIONS[event.key])
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                    game.session.toggle_hints()
             else:
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
                     game.in_level_selection = True
+                    game.invalidate()
+        if profiler:
+            profiler.mark('input')
         
         if game.in_level_selection:
-            game.draw_level_selection()
+            dirty = game.draw_level_selection()
         else:
-            if not game.game_over:
+            if game.session.playing:
                 game.update()
-            game.draw_grid()
-            
-        pygame.display.update()
+            if profiler:
+                profiler.mark('update')
+            dirty = game.draw_grid()
+        
+        if profiler:
+            profiler.mark('draw')
+            if profiler.frame_start >= next_overlay:
+                next_overlay = profiler.frame_start + PROFILE_REFRESH
+                dirty.append(game.draw_profile(profiler))
+        
+        # Push only the changed parts of the screen
+        if dirty:
+            pygame.display.update(dirty)
+        if startup_probe:
+            print(f"first-frame {time.time():.6f}", flush=True)
+            running = False
+        if profiler:
+            profiler.mark('display')
+            profiler.end_frame()
         clock.tick(60)
     
+    # Keep a recording of a game that was quit mid-way
+    if not game.in_level_selection:
+        game.session.save_replay()
+    game.session.close()
+    if profiler:
+        profiler.dump(profile_path)
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Tetris")
+    parser.add_argument('--record', metavar='DIR', 
+                        help="save a replay of every game to DIR")
+    parser.add_argument('--replay', metavar='FILE', 
+                        help="play back a recorded replay")
+    parser.add_argument('--profile', metavar='TRACE', nargs='?', const='tetris-trace.json', 
+                        help="show frame timings and write a trace file on exit")
+    parser.add_argument('--bot', action='store_true', 
+                        help="let the autoplayer play")
+    parser.add_argument('--scores', metavar='FILE', 
+                        help="keep game results in this database (default: ~/.tetris/scores.db)")
+    parser.add_argument('--no-scores', dest='scores', action='store_const', const=False, 
+                        help="do not keep game results")
+    parser.add_argument('--hint', action='store_true', 
+                        help="outline the best placement for each piece (toggle with H)")
+    args = parser.parse_args()
+    main(args.record, args.replay, args.profile, args.bot, args.scores, args.hint)
@@ -0,0 +1,402 @@
+import random
+import threading
+from collections import OrderedDict, namedtuple
+
+from tetris_bitboard import FULL_ROW, PIECE_MASKS
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, LEFT, RIGHT, ROTATE, DROP, Tetrimino
+
+# Autoplayer: enumerates every placement reachable from the spawn position
+# (rotate in place, slide sideways, hard drop) for the current piece and,
+# optionally, the next one, and picks the pair with the best heuristic
+# score. Boards are handled as bitboard rows (see tetris_bitboard), so a
+# placement costs a few integer operations.
+
+# Heuristic weights, from the well-known hand-tuned linear evaluation
+# (aggregate height, completed lines, holes, bumpiness).
+DEFAULT_WEIGHTS = {
+    'height': -0.510066,
+    'lines': 0.760666,
+    'holes': -0.35663,
+    'bumpiness': -0.184483,
+}
+
+Placement = namedtuple('Placement', 'rotation x y score')
+Hint = namedtuple('Hint', 'piece placement')
+
+# Set bits in a row, for every possible row value
+POPCOUNT = tuple(bin(row).count('1') for row in range(1 << GRID_WIDTH))
+
+
+def _build_zobrist(seed=0x7e7215):
+    # Zobrist hashing: a random 64-bit key per cell, a board's hash is the XOR
+    # of the keys of its filled cells. ROW_KEYS[y][row] is that XOR for every
+    # value of row y, built one bit at a time from the value without its
+    # lowest bit. Fixed seed, so hashes are stable between runs.
+    rng = random.Random(seed)
+    table = []
+    for _ in range(GRID_HEIGHT):
+        cell_keys = [rng.getrandbits(64) for _ in range(GRID_WIDTH)]
+        keys = [0] * (1 << GRID_WIDTH)
+        for row in range(1, 1 << GRID_WIDTH):
+            low = row & -row
+            keys[row] = keys[row ^ low] ^ cell_keys[low.bit_length() - 1]
+        table.append(tuple(keys))
+    return tuple(table)
+
+
+ROW_KEYS = _build_zobrist()
+
+
+def rows_of(game):
+    # Bitboard rows of a game, whichever board it uses
+    board = getattr(game, 'board', None)
+    if board is not None:
+        return board.rows
+    return [sum(1 << x for x, cell in enumerate(row) if cell) for row in game.grid]
+
+
+def board_hash(rows):
+    result = 0
+    for y, row in enumerate(rows):
+        if row:
+            result ^= ROW_KEYS[y][row]
+    return result
+
+
+def piece_hash(shape_index, rotation, x, y):
+    # XOR into a board's hash to add (or remove) the piece's cells
+    result = 0
+    for i, mask in enumerate(PIECE_MASKS[shape_index][rotation][x]):
+        result ^= ROW_KEYS[y + i][mask]
+    return result
+
+
+class TranspositionCache:
+    # Size-bounded LRU map from (board hash, piece, ...) keys to search
+    # results, with hit and miss counts. Values must not be None. An entry
+    # takes about 1.4 KB, mostly its tuple of placements.
+    def __init__(self, max_size=4096):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+def fits(rows, masks, y):
+    if y + len(masks) > GRID_HEIGHT:
+        return False
+    for i, mask in enumerate(masks):
+        if y + i >= 0 and rows[y + i] & mask:
+            return False
+    return True
+
+
+def placements(rows, shape_index, x=GRID_WIDTH // 2 - 1, y=0, start_rotation=0):
+    # Yield (rotation, x, y) for every resting position reachable from (x, y)
+    # by rotating in place, then sliding sideways, then dropping
+    masks = PIECE_MASKS[shape_index]
+    for turns in range(4):
+        rotation = (start_rotation + turns) & 3
+        if masks[rotation][x] is None or not fits(rows, masks[rotation][x], y):
+            # Rotation blocked at the spawn column; later ones are too
+            return
+        columns = masks[rotation]
+
+        # Slide as far as possible both ways
+        left = x
+        while left > 0 and columns[left - 1] is not None and fits(rows, columns[left - 1], y):
+            left -= 1
+        right = x
+        while right + 1 < GRID_WIDTH and columns[right + 1] is not None and fits(rows, columns[right + 1], y):
+            right += 1
+
+        for column in range(left, right + 1):
+            column_masks = columns[column]
+            drop = y
+            while fits(rows, column_masks, drop + 1):
+                drop += 1
+            yield rotation, column, drop
+
+        # The O piece looks the same in every rotation
+        if shape_index == 1:
+            return
+
+
+def place(rows, shape_index, rotation, x, y):
+    # New rows with the piece locked and full rows removed, plus lines cleared
+    new_rows = list(rows)
+    for i, mask in enumerate(PIECE_MASKS[shape_index][rotation][x]):
+        new_rows[y + i] |= mask
+    kept = [row for row in new_rows if row != FULL_ROW]
+    cleared = GRID_HEIGHT - len(kept)
+    if cleared:
+        new_rows = [0] * cleared + kept
+    return new_rows, cleared
+
+
+def features(rows):
+    # Aggregate height, holes and bumpiness of a board
+    heights = [0] * GRID_WIDTH
+    seen = 0
+    holes = 0
+    for y, row in enumerate(rows):
+        if not seen and not row:
+            continue
+        # Empty cells under a filled cell are holes
+        holes += POPCOUNT[seen & ~row & FULL_ROW]
+        new = row & ~seen
+        if new:
+            # Columns whose top block is in this row
+            height = GRID_HEIGHT - y
+            seen |= row
+            while new:
+                low = new & -new
+                heights[low.bit_length() - 1] = height
+                new ^= low
+    bumpiness = 0
+    for x in range(GRID_WIDTH - 1):
+        bumpiness += abs(heights[x] - heights[x + 1])
+    return sum(heights), holes, bumpiness
+
+
+def evaluate(rows, lines, weights):
+    height, holes, bumpiness = features(rows)
+    return (weights['height'] * height + weights['lines'] * lines +
+            weights['holes'] * holes + weights['bumpiness'] * bumpiness)
+
+
+def play_random(game, rng, gravity_ticks=2, max_pieces=None):
+    # Baseline player making seeded random placements: pick a rotation and
+    # column for each piece, walk it there with a little gravity in between,
+    # then hard drop. Returns the number of actions applied.
+    moves = 0
+    while not game.game_over:
+        if max_pieces is not None and game.pieces_locked >= max_pieces:
+            break
+        piece = game.current_piece
+        for _ in range(rng.randrange(4)):
+            game.apply(ROTATE)
+            moves += 1
+        target = rng.randrange(GRID_WIDTH)
+        while piece is game.current_piece and piece.x != target and not game.game_over:
+            if not game.apply(LEFT if target < piece.x else RIGHT):
+                break
+            moves += 1
+            game.advance(gravity_ticks)
+        if piece is game.current_piece and not game.game_over:
+            game.apply(DROP)
+            moves += 1
+    return moves
+
+
+class AutoPlayer:
+    # Pass cache_size=0 to search without a transposition cache. A cache
+    # holds scores for this player's weights, so it is never shared. Nearly
+    # all hits are repeats within one search, so a few thousand entries
+    # (about 6 MB) hit as often as 50000 did (65 MB).
+    def __init__(self, weights=None, lookahead=True, cache_size=4096):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.lookahead = lookahead
+        self.cache = TranspositionCache(cache_size) if cache_size else None
+        self.evaluated = 0  # Boards scored so far, for throughput numbers
+
+    def moves(self, rows, rows_hash, shape_index, x=GRID_WIDTH // 2 - 1, y=0, rotation=0):
+        # Reachable placements, cached by board and piece
+        if self.cache is None:
+            return placements(rows, shape_index, x, y, rotation)
+        key = (rows_hash, shape_index, x, y, rotation)
+        result = self.cache.get(key)
+        if result is None:
+            result = tuple(placements(rows, shape_index, x, y, rotation))
+            self.cache.put(key, result)
+        return result
+
+    def score(self, rows, rows_hash, lines, next_index):
+        # Score of a board reached by clearing lines: its own evaluation, or
+        # with lookahead the best one over the next piece's placements
+        cache = self.cache
+        if cache is not None:
+            key = (rows_hash, lines, next_index)
+            score = cache.get(key)
+            if score is not None:
+                return score
+
+        weights = self.weights
+        if next_index is None:
+            score = evaluate(rows, lines, weights)
+            self.evaluated += 1
+        else:
+            # The next piece could not spawn; only take this if forced
+            score = float('-inf')
+            for rotation, x, y in self.moves(rows, rows_hash, next_index):
+                final, next_lines = place(rows, next_index, rotation, x, y)
+                value = evaluate(final, lines + next_lines, weights)
+                self.evaluated += 1
+                if value > score:
+                    score = value
+
+        if cache is not None:
+            cache.put(key, score)
+        return score
+
+    def best_placement(self, game, cancelled=None):
+        # cancelled, if given, is polled between candidates; the search
+        # gives up and returns None once it returns true
+        rows = rows_of(game)
+        piece = game.current_piece
+        shape_index = piece.shape_index
+        next_index = game.next_piece.shape_index if self.lookahead else None
+        hashing = self.cache is not None
+        rows_hash = board_hash(rows) if hashing else None
+
+        best = None
+        for rotation, x, y in self.moves(rows, rows_hash, shape_index, piece.x, piece.y, piece.rotation):
+            if cancelled is not None and cancelled():
+                return None
+            after, lines = place(rows, shape_index, rotation, x, y)
+            after_hash = None
+            if hashing:
+                # Without a line clear the new hash is one XOR away
+                after_hash = (board_hash(after) if lines else
+                              rows_hash ^ piece_hash(shape_index, rotation, x, y))
+            score = self.score(after, after_hash, lines, next_index)
+            if best is None or score > best.score:
+                best = Placement(rotation, x, y, score)
+        return best
+
+    def actions(self, game, placement):
+        # Inputs that take the current piece to placement and lock it
+        piece = game.current_piece
+        actions = [ROTATE] * ((placement.rotation - piece.rotation) % 4)
+        shift = placement.x - piece.x
+        actions += [LEFT if shift < 0 else RIGHT] * abs(shift)
+        actions.append(DROP)
+        return actions
+
+    def play_piece(self, game):
+        # Place the current piece right away; False if there is no move
+        placement = self.best_placement(game)
+        if placement is None:
+            return False
+        for action in self.actions(game, placement):
+            game.apply(action)
+        return True
+
+    def play_game(self, game, max_pieces=None):
+        # Play headless at full speed until game over or max_pieces locks
+        while not game.game_over:
+            if max_pieces is not None and game.pieces_locked >= max_pieces:
+                break
+            if not self.play_piece(game):
+                game.drop()
+        return game
+
+    def play_paced(self, game, input_ticks, max_pieces=None):
+        # Play headless like a human limited to one input every input_ticks
+        # simulation ticks, so gravity and the level's fall speed matter
+        while not game.game_over:
+            if max_pieces is not None and game.pieces_locked >= max_pieces:
+                break
+            piece = game.current_piece
+            placement = self.best_placement(game)
+            actions = self.actions(game, placement) if placement else [DROP]
+            for action in actions:
+                game.apply(action)
+                if piece is not game.current_piece or game.game_over:
+                    break
+                game.advance(input_ticks)
+                if piece is not game.current_piece:
+                    # Gravity locked the piece before the plan finished
+                    break
+        return game
+
+
+class _Position:
+    # The parts of a game best_placement reads, copied so the game can move
+    # on while a search runs elsewhere
+    def __init__(self, game):
+        self.rows = list(rows_of(game))
+        piece = game.current_piece
+        self.current_piece = Tetrimino(piece.x, piece.y, piece.shape_index)
+        self.current_piece.rotation = piece.rotation
+        self.next_piece = game.next_piece
+        self.board = self  # rows_of takes a board's rows
+
+
+class HintWorker:
+    # Finds the best placement of the current piece on a background thread,
+    # so the search never holds up a frame. request() copies the position
+    # and returns at once; a newer request cancels the search in progress.
+    # The result is published by replacing hint with an immutable Hint for
+    # the piece it was made for, which the draw code reads without a lock.
+    # on_ready, if given, is called from the worker thread after each.
+    def __init__(self, player=None, on_ready=None):
+        # One search at a time, so a small cache is enough
+        self.player = player if player is not None else AutoPlayer(cache_size=1024)
+        self.on_ready = on_ready
+        self.hint = None
+        self.job = None
+        self.generation = 0
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='hints', daemon=True)
+        self.thread.start()
+
+    def request(self, game):
+        self.generation += 1
+        self.job = (self.generation, game.current_piece, _Position(game))
+        self.wakeup.set()
+
+    def cancel(self):
+        self.generation += 1
+        self.job = None
+        self.hint = None
+
+    def close(self):
+        self.running = False
+        self.cancel()
+        self.wakeup.set()
+        self.thread.join()
+
+    def run(self):
+        done = 0
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # Only ever the latest request; older ones were replaced
+            job = self.job
+            if job is None or job[0] == done:
+                continue
+            generation, piece, position = job
+            done = generation
+            placement = self.player.best_placement(
+                position, lambda: self.generation != generation)
+            if placement is not None and self.generation == generation:
+                self.hint = Hint(piece, placement)
+                if self.on_ready is not None:
+                    self.on_ready()
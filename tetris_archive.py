@@ -0,0 +1,403 @@
+import argparse
+import bisect
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import tetris_core
+from tetris_core import PieceGenerator, TICK_RATE
+from tetris_replay import Replay, ReplayPlayer, decode_varint
+from tetris_snapshot import KEYFRAME, SnapshotEncoder, GameMirror
+
+# Append-only archive of many recorded games, read through mmap.
+#
+#   python3 tetris_archive.py add games.tta replays/*.ttr
+#   python3 tetris_archive.py generate games.tta --games 1000 --policy bot
+#   python3 tetris_archive.py top games.tta --level 5
+#   python3 tetris_archive.py show games.tta 42 --at 5:00
+#
+# Each game is stored as a tetris_snapshot stream, with a full keyframe
+# every KEYFRAME_TICKS and deltas in between, so playback can start at any
+# keyframe instead of at the beginning. The stream is preceded by the
+# game's keyframe table of (tick, offset) pairs.
+#
+# Layout: a fixed header, the leaderboards, then game data and index blocks
+# in the order they were appended. An index block holds BLOCK_ENTRIES fixed-size entries
+# (offset, size, seed, score, lines, levels, ticks, ...) and the offset of
+# the next block; the header points at the first and last block and holds
+# the number of games. Appending writes the game data and its entry first
+# and bumps the count last, so readers never see a half-written game.
+#
+# The leaderboards hold the TOP_ENTRIES best (score, game) pairs over all
+# games and for each starting level up to TOP_LEVELS, kept sorted by the
+# writer as it appends, so a top-N query reads one of them instead of
+# scanning the index.
+#
+# Finding game n is arithmetic on the block list; its entry is read from
+# the map when asked for, so opening or refreshing an archive costs the same
+# with ten games in it or a million.
+
+MAGIC = b'TTAR'
+VERSION = 2
+HEADER = struct.Struct('<4sBxHIQQ')  # magic, version, block entries, games, first block, last block
+ENTRY = struct.Struct('<QIIQIIBBBxIQ')  # offset, size, keyframes, seed, score, lines,
+                                        # start level, level, piece mode, ticks, recorded
+NEXT_BLOCK = struct.Struct('<Q')
+KEYFRAME_ENTRY = struct.Struct('<II')  # tick, offset in the stream
+TOP_COUNT = struct.Struct('<I')
+TOP_ENTRY = struct.Struct('<II')  # score, game
+
+BLOCK_ENTRIES = 1024
+KEYFRAME_TICKS = 10 * TICK_RATE
+TOP_ENTRIES = 100
+TOP_LEVELS = 30  # Leaderboard 0 covers every game, 1 to TOP_LEVELS one starting level each
+BOARD_SIZE = TOP_COUNT.size + TOP_ENTRIES * TOP_ENTRY.size
+
+GameEntry = namedtuple('GameEntry', 'index offset size keyframes seed score lines '
+                                    'start_level level piece_mode ticks recorded')
+
+
+class GameRecorder:
+    # Builds one game's archive record; call record() after every input and
+    # every tick, then finish() once the game is over
+    def __init__(self, game, keyframe_ticks=KEYFRAME_TICKS):
+        self.game = game
+        self.keyframe_ticks = keyframe_ticks
+        self.encoder = SnapshotEncoder(game)
+        self.start_level = game.level
+        self.start_lines = game.lines_cleared
+        self.keyframes = []
+        self.stream = bytearray()
+        self.keyframe()
+
+    def keyframe(self):
+        self.keyframes.append((self.game.ticks, len(self.stream)))
+        self.stream += self.encoder.keyframe()
+        self.next_keyframe = self.game.ticks + self.keyframe_ticks
+
+    def record(self):
+        if self.game.ticks >= self.next_keyframe:
+            self.keyframe()
+            return
+        delta = self.encoder.delta()
+        if delta is not None:
+            self.stream += delta
+
+    def finish(self):
+        # (entry fields after offset and size, record bytes)
+        self.record()
+        game = self.game
+        table = b''.join(KEYFRAME_ENTRY.pack(*keyframe) for keyframe in self.keyframes)
+        fields = (len(self.keyframes), game.seed, game.score, game.lines_cleared - self.start_lines,
+                  self.start_level, game.level, PieceGenerator.MODES.index(game.piece_mode),
+                  game.ticks, int(time.time()))
+        return fields, table + bytes(self.stream)
+
+
+class ArchiveWriter:
+    def __init__(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, BLOCK_ENTRIES, 0, 0, 0))
+                f.write(bytes((TOP_LEVELS + 1) * BOARD_SIZE))
+        self.file = open(path, 'r+b')
+        data = self.file.read(HEADER.size + (TOP_LEVELS + 1) * BOARD_SIZE)
+        _, self.block_entries, self.count, self.first_block, self.last_block = read_header(data)
+        self.boards = [read_board(data, board) for board in range(TOP_LEVELS + 1)]
+
+    def append(self, recorder):
+        fields, data = recorder.finish()
+        f = self.file
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+        slot = self.count % self.block_entries
+        if slot == 0:
+            # Start a new index block and link it from the previous one
+            block = f.tell()
+            f.write(bytes(NEXT_BLOCK.size + self.block_entries * ENTRY.size))
+            if self.last_block:
+                f.seek(self.last_block)
+                f.write(NEXT_BLOCK.pack(block))
+            else:
+                self.first_block = block
+            self.last_block = block
+        f.seek(self.last_block + NEXT_BLOCK.size + slot * ENTRY.size)
+        f.write(ENTRY.pack(offset, len(data), *fields))
+        score, start_level = fields[2], fields[4]
+        self.rank(0, score)
+        if 1 <= start_level <= TOP_LEVELS:
+            self.rank(start_level, score)
+        f.flush()
+        self.count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, self.block_entries, self.count,
+                            self.first_block, self.last_block))
+        f.flush()
+        return self.count - 1
+
+    def rank(self, board, score):
+        # Put the game being appended on a leaderboard if it makes the cut,
+        # after earlier games with the same score
+        entries = self.boards[board]
+        place = bisect.bisect_right([-entry[0] for entry in entries], -score)
+        if place >= TOP_ENTRIES:
+            return
+        entries.insert(place, (score, self.count))
+        del entries[TOP_ENTRIES:]
+        self.file.seek(board_offset(board))
+        self.file.write(TOP_COUNT.pack(len(entries)) +
+                        b''.join(TOP_ENTRY.pack(*entry) for entry in entries))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(data):
+    magic, version, block_entries, count, first_block, last_block = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a Tetris archive")
+    if version != VERSION:
+        raise ValueError(f"Unsupported archive version: {version}")
+    return version, block_entries, count, first_block, last_block
+
+
+def board_offset(board):
+    return HEADER.size + board * BOARD_SIZE
+
+
+def read_board(data, board):
+    # A leaderboard's (score, game) pairs, best first
+    start = board_offset(board)
+    used, = TOP_COUNT.unpack_from(data, start)
+    start += TOP_COUNT.size
+    return list(TOP_ENTRY.iter_unpack(data[start:start + used * TOP_ENTRY.size]))
+
+
+class Archive:
+    # Read-only view of an archive; refresh() picks up games appended since
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = None
+        self.count = 0
+        self.blocks = []
+        self.refresh()
+
+    def refresh(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if self.data is not None and len(self.data) == size:
+            return
+        if self.data is not None:
+            self.data.close()
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.block_entries, self.count, first_block, _ = read_header(self.data)
+        # Follow the chain only past the blocks already known
+        if not self.blocks and self.count:
+            self.blocks.append(first_block)
+        while len(self.blocks) * self.block_entries < self.count:
+            self.blocks.append(NEXT_BLOCK.unpack_from(self.data, self.blocks[-1])[0])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("game index out of range")
+        block, slot = divmod(index, self.block_entries)
+        return GameEntry(index, *ENTRY.unpack_from(
+            self.data, self.blocks[block] + NEXT_BLOCK.size + slot * ENTRY.size))
+
+    def top(self, count=10, start_level=None):
+        board = 0 if start_level is None else start_level
+        if count <= TOP_ENTRIES and (start_level is None or 1 <= start_level <= TOP_LEVELS):
+            # Skip a game a writer has ranked but not yet counted
+            return [self[index] for _, index in read_board(self.data, board)[:count + 1]
+                    if index < self.count][:count]
+        # Longer lists and levels without a leaderboard read the whole index
+        entries = (self[index] for index in range(self.count))
+        if start_level is not None:
+            entries = (entry for entry in entries if entry.start_level == start_level)
+        return heapq.nlargest(count, entries, key=lambda entry: entry.score)
+
+    def player(self, index):
+        return ArchivePlayer(self.data, self[index])
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchivePlayer:
+    # Plays back one archived game from its snapshot stream. seek() jumps to
+    # the last keyframe at or before a tick and applies deltas from there;
+    # advance() and advance_to() play forward like ReplayPlayer. game.ticks
+    # is the tick of the last change, tick the playback position.
+    def __init__(self, data, entry):
+        self.entry = entry
+        table_size = entry.keyframes * KEYFRAME_ENTRY.size
+        table = KEYFRAME_ENTRY.iter_unpack(data[entry.offset:entry.offset + table_size])
+        self.keyframe_ticks, self.keyframe_offsets = zip(*table)
+        # A copy, so the archive can be remapped while this plays
+        self.stream = data[entry.offset + table_size:entry.offset + entry.size]
+        self.seek(0)
+
+    @property
+    def finished(self):
+        return self.tick >= self.entry.ticks
+
+    def seek(self, tick):
+        keyframe = max(bisect.bisect_right(self.keyframe_ticks, tick) - 1, 0)
+        self.game = GameMirror()
+        self.pos = self.game.apply(self.stream, self.keyframe_offsets[keyframe])
+        self.tick = self.game.ticks
+        self.advance_to(tick)
+        return self.game
+
+    def advance(self, ticks):
+        self.advance_to(self.tick + ticks)
+
+    def advance_to(self, target):
+        # Apply every message up to and including tick target
+        stream = self.stream
+        game = self.game
+        while self.pos < len(stream):
+            flags = stream[self.pos]
+            value, _ = decode_varint(stream, self.pos + 1)
+            if (value if flags & KEYFRAME else game.ticks + value) > target:
+                break
+            self.pos = game.apply(stream, self.pos)
+        self.tick = max(self.tick, min(target, self.entry.ticks))
+
+
+class _RecordedGame(tetris_core.Game):
+    # A core Game that records itself as it is played headless
+    recorder = None
+
+    def apply(self, action):
+        moved = super().apply(action)
+        self.recorder.record()
+        return moved
+
+    def step(self):
+        super().step()
+        self.recorder.record()
+
+
+def add_replays(writer, paths):
+    for path in paths:
+        replay = Replay.load(path)
+        player = ReplayPlayer(replay, _RecordedGame(replay.level, replay.seed, replay.piece_mode))
+        # The recorder starts from the state the player reset the game to
+        player.game.recorder = GameRecorder(player.game)
+        player.run()
+        writer.append(player.game.recorder)
+
+
+def generate(writer, games, levels, policy, seed, input_ticks=6):
+    bot = None
+    if policy == 'bot':
+        from tetris_ai import AutoPlayer
+        bot = AutoPlayer(lookahead=False)
+    from tetris_ai import play_random
+    for i in range(games):
+        game = _RecordedGame(levels[i % len(levels)], seed + i, 'bag')
+        game.recorder = GameRecorder(game)
+        if bot is not None:
+            bot.play_paced(game, input_ticks)
+        else:
+            play_random(game, random.Random(seed + i), gravity_ticks=input_ticks)
+        writer.append(game.recorder)
+
+
+def parse_time(text):
+    # "90" seconds or "5:00" minutes and seconds, as a tick
+    minutes, _, seconds = text.rpartition(':')
+    return round((int(minutes or 0) * 60 + float(seconds)) * TICK_RATE)
+
+
+def format_board(game):
+    lines = [''.join('.' if cell == tetris_core.EMPTY else 'G' if cell == tetris_core.GARBAGE
+                     else str(cell) for cell in row) for row in game.grid]
+    piece = game.current_piece
+    for dx, dy in piece.cells:
+        x, y = piece.x + dx, piece.y + dy
+        if 0 <= y < len(lines):
+            lines[y] = lines[y][:x] + '#' + lines[y][x + 1:]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris replay archive")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="append recorded replays")
+    add.add_argument('archive')
+    add.add_argument('replays', nargs='+')
+    gen = commands.add_parser('generate', help="append seeded headless games")
+    gen.add_argument('archive')
+    gen.add_argument('--games', type=int, default=100)
+    gen.add_argument('--levels', default='1-10')
+    gen.add_argument('--policy', choices=('random', 'bot'), default='random')
+    gen.add_argument('--seed', type=int, default=0)
+    top = commands.add_parser('top', help="print the leaderboard")
+    top.add_argument('archive')
+    top.add_argument('--level', type=int, help="only games started at this level")
+    top.add_argument('--count', type=int, default=10)
+    show = commands.add_parser('show', help="print a game's board at a point in time")
+    show.add_argument('archive')
+    show.add_argument('game', type=int)
+    show.add_argument('--at', type=parse_time, default=0, metavar='[MIN:]SEC')
+    args = parser.parse_args(argv)
+
+    if args.command in ('add', 'generate'):
+        start = time.perf_counter()
+        with ArchiveWriter(args.archive) as writer:
+            before = writer.count
+            if args.command == 'add':
+                add_replays(writer, args.replays)
+            else:
+                from tetris_batch import parse_levels
+                generate(writer, args.games, parse_levels(args.levels), args.policy, args.seed)
+            added = writer.count - before
+        print(f"added {added} games in {time.perf_counter() - start:.1f} s; "
+              f"{os.path.getsize(args.archive) / 1e6:.1f} MB")
+        return 0
+
+    with Archive(args.archive) as archive:
+        if args.command == 'top':
+            start = time.perf_counter()
+            entries = archive.top(args.count, args.level)
+            elapsed = time.perf_counter() - start
+            for rank, entry in enumerate(entries, 1):
+                print(f"{rank:3}. {entry.score:8} points {entry.lines:5} lines  level {entry.start_level}-"
+                      f"{entry.level}  {entry.ticks / TICK_RATE / 60:5.1f} min  game {entry.index}")
+            print(f"{len(archive)} games, leaderboard in {elapsed * 1000:.1f} ms")
+        else:
+            start = time.perf_counter()
+            game = archive.player(args.game).seek(args.at)
+            elapsed = time.perf_counter() - start
+            print(format_board(game))
+            print(f"tick {game.ticks}: {game.score} points, {game.lines_cleared} lines, "
+                  f"level {game.level}; seek took {elapsed * 1000:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from tetris_ai import AutoPlayer, play_random
+from tetris_bitboard import BitBoardGame
+from tetris_core import TICK_RATE
+
+# Headless batch simulation sharded across a process pool.
+#
+#   python3 tetris_batch.py --games 100000 --levels 1-10 --policy bot
+#
+# Work is split into blocks of consecutive seeds per starting level. Each
+# worker plays a block and sends back merged statistics (and, if asked, one
+# small record per game), so the parent streams results as blocks finish
+# and never holds every game in memory.
+
+POLICIES = ('random', 'bot', 'bot2')
+
+# One AutoPlayer per policy and worker process, so its transposition cache
+# carries over between games (same seeds at different levels share openings)
+_players = {}
+
+
+class RunningStats:
+    # Count, mean, variance, min and max without keeping the samples;
+    # partial results from different workers merge exactly
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.__dict__.update(other.__dict__)
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def stdev(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+
+def play(seed, level, policy, max_pieces, input_ticks, piece_mode):
+    # One seeded game; returns (score, lines, survival seconds, pieces)
+    game = BitBoardGame(level, seed, piece_mode)
+    start_lines = game.lines_cleared
+    if policy == 'random':
+        play_random(game, random.Random(seed), input_ticks, max_pieces)
+    else:
+        bot = _players.get(policy)
+        if bot is None:
+            bot = _players[policy] = AutoPlayer(lookahead=(policy == 'bot2'))
+        bot.play_paced(game, input_ticks, max_pieces)
+    return game.score, game.lines_cleared - start_lines, game.ticks / TICK_RATE, game.pieces_locked
+
+
+def run_block(task):
+    level, first_seed, count, options, keep_games = task
+    stats = {name: RunningStats() for name in ('score', 'lines', 'survival', 'pieces')}
+    games = []
+    for seed in range(first_seed, first_seed + count):
+        score, lines, survival, pieces = play(seed, level, **options)
+        stats['score'].add(score)
+        stats['lines'].add(lines)
+        stats['survival'].add(survival)
+        stats['pieces'].add(pieces)
+        if keep_games:
+            games.append((seed, score, lines, survival, pieces))
+    return level, stats, games
+
+
+def tasks(games, levels, seed, block, options, keep_games):
+    # Generated lazily so millions of games never exist as one list
+    for level in levels:
+        for first in range(seed, seed + games, block):
+            yield level, first, min(block, seed + games - first), options, keep_games
+
+
+def run(games, levels, policy='bot', seed=0, block=100, workers=None,
+        max_pieces=500, input_ticks=6, piece_mode='bag', on_games=None):
+    # Play games seeds for every starting level; returns {level: stats}.
+    # on_games, if given, is called with each finished block's per-game rows.
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy: {policy!r}")
+    options = {'policy': policy, 'max_pieces': max_pieces,
+               'input_ticks': input_ticks, 'piece_mode': piece_mode}
+    results = {level: {name: RunningStats() for name in ('score', 'lines', 'survival', 'pieces')}
+               for level in levels}
+
+    work = tasks(games, levels, seed, block, options, on_games is not None)
+    with multiprocessing.Pool(workers) as pool:
+        for level, stats, rows in pool.imap_unordered(run_block, work):
+            for name, partial in stats.items():
+                results[level][name].merge(partial)
+            if on_games is not None:
+                on_games(level, rows)
+    return results
+
+
+def parse_levels(text):
+    # "1-10" or "1,3,5"
+    levels = []
+    for part in text.split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            levels.extend(range(int(low), int(high) + 1))
+        else:
+            levels.append(int(part))
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel headless Tetris simulation")
+    parser.add_argument('--games', type=int, default=1000, help="games per starting level")
+    parser.add_argument('--levels', type=parse_levels, default=list(range(1, 11)))
+    parser.add_argument('--policy', choices=POLICIES, default='bot')
+    parser.add_argument('--seed', type=int, default=0, help="first seed")
+    parser.add_argument('--block', type=int, default=100, help="games per worker task")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--max-pieces', type=int, default=500, help="stop a game after this many pieces")
+    parser.add_argument('--input-ticks', type=int, default=6,
+                        help="simulation ticks between inputs (60 ticks = 1 s)")
+    parser.add_argument('--piece-mode', choices=('uniform', 'bag'), default='bag')
+    parser.add_argument('--output', metavar='FILE', help="stream one JSON line per game to FILE")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w') if args.output else None
+
+    def write_games(level, rows):
+        for seed, score, lines, survival, pieces in rows:
+            out.write(json.dumps({'level': level, 'seed': seed, 'score': score, 'lines': lines,
+                                  'survival': survival, 'pieces': pieces}) + '\n')
+
+    start = time.perf_counter()
+    try:
+        results = run(args.games, args.levels, args.policy, args.seed, args.block, args.workers,
+                      args.max_pieces, args.input_ticks, args.piece_mode,
+                      write_games if out else None)
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"{'level':>5} {'games':>8} {'score':>10} {'±':>8} {'lines':>8} {'survival s':>11} {'pieces':>8}")
+    for level in args.levels:
+        stats = results[level]
+        print(f"{level:5d} {stats['score'].count:8d} {stats['score'].mean:10.1f} {stats['score'].stdev:8.1f} "
+              f"{stats['lines'].mean:8.1f} {stats['survival'].mean:11.1f} {stats['pieces'].mean:8.1f}")
+    total = args.games * len(args.levels)
+    print(f"{total} games in {elapsed:.1f} s ({total / elapsed:.0f} games/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
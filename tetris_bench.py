@@ -0,0 +1,320 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import tetris_core
+from tetris_ai import AutoPlayer, play_random
+from tetris_bitboard import FULL_ROW, BitBoardGame
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, LEFT, RIGHT, ROTATE
+from tetris_snapshot import SnapshotEncoder, GameMirror
+
+# Benchmarks for the engine hot paths and the pygame renderer.
+#
+#   python3 tetris_bench.py --output bench.json
+#   python3 tetris_bench.py --compare bench.json
+#
+# Engine benchmarks run seeded headless games, so numbers are comparable
+# across commits. Rendering is timed into an offscreen surface through SDL's
+# dummy video driver and is skipped if pygame is not installed; the batched
+# NumPy evaluation is likewise skipped without NumPy.
+
+BOARDS = {
+    'grid': tetris_core.Game,
+    'bitboard': BitBoardGame,
+}
+
+
+def best_of(repeat, func):
+    # Smallest wall time over several runs of func
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def best_prepared(repeat, prepare, func):
+    # Like best_of, but func takes fresh untimed input from prepare each run
+    best = None
+    for _ in range(repeat):
+        data = prepare()
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_games(board, games, seed):
+    game_class = BOARDS[board]
+    totals = {'moves': 0, 'locks': 0, 'lines': 0, 'ticks': 0}
+
+    start = time.perf_counter()
+    for i in range(games):
+        game = game_class(1, seed + i, 'bag')
+        totals['moves'] += play_random(game, random.Random(seed + i))
+        totals['locks'] += game.pieces_locked
+        totals['lines'] += game.lines_cleared
+        totals['ticks'] += game.ticks
+    elapsed = time.perf_counter() - start
+
+    return {
+        f'{board}.games_per_s': (games / elapsed, 'games/s'),
+        f'{board}.moves_per_s': (totals['moves'] / elapsed, 'moves/s'),
+        f'{board}.locks_per_s': (totals['locks'] / elapsed, 'locks/s'),
+        f'{board}.lines_per_s': (totals['lines'] / elapsed, 'lines/s'),
+    }
+
+
+def filled_game(board, seed, rows=8):
+    # A game whose bottom rows are filled with one gap each
+    rng = random.Random(seed)
+    game = BOARDS[board](1, seed)
+    for y in range(GRID_HEIGHT - rows, GRID_HEIGHT):
+        gap = rng.randrange(GRID_WIDTH)
+        for x in range(GRID_WIDTH):
+            if x != gap:
+                fill_cell(game, x, y)
+    recount(game)
+    return game
+
+
+def fill_cell(game, x, y):
+    if hasattr(game, 'board'):
+        game.board.fill(x, y)
+    else:
+        game.grid[y][x] = 1
+
+
+def recount(game):
+    # The grid board tracks row counts and heights incrementally
+    if not hasattr(game, 'board'):
+        game.recount()
+
+
+def bench_ops(board, seed, count=20000, repeat=5):
+    results = {}
+
+    # Collision checks on a half-filled board, all rotations and columns
+    game = filled_game(board, seed)
+    piece = game.current_piece
+    offsets = [(dx, dy, rotation) for rotation in range(4)
+               for dx in range(-piece.x, GRID_WIDTH - piece.x)
+               for dy in range(0, GRID_HEIGHT - 8)]
+    calls = (count // len(offsets) + 1) * len(offsets)
+
+    def collisions():
+        for _ in range(calls // len(offsets)):
+            for dx, dy, rotation in offsets:
+                game.collision(piece, dx, dy, rotation)
+    results[f'{board}.collision_per_s'] = (calls / best_of(repeat, collisions), 'calls/s')
+
+    # Hard drops from the spawn position onto the filled board
+    drops = count // 20
+
+    def drop_all(games):
+        for game in games:
+            game.drop()
+    elapsed = best_prepared(repeat, lambda: [filled_game(board, seed) for _ in range(drops)], drop_all)
+    results[f'{board}.drop_per_s'] = (drops / elapsed, 'drops/s')
+
+    # Clearing four full rows at once
+    clears = count // 20
+
+    def full_rows_game():
+        game = filled_game(board, seed, rows=0)
+        for y in range(GRID_HEIGHT - 4, GRID_HEIGHT):
+            for x in range(GRID_WIDTH):
+                fill_cell(game, x, y)
+        recount(game)
+        return game
+
+    def clear_all(games):
+        for game in games:
+            game.clear_lines()
+    elapsed = best_prepared(repeat, lambda: [full_rows_game() for _ in range(clears)], clear_all)
+    results[f'{board}.clear_lines_per_s'] = (clears / elapsed, 'clears/s')
+    return results
+
+
+def bench_ai(pieces, seed):
+    # Two-piece placement search on a bitboard game
+    bot = AutoPlayer()
+    game = BitBoardGame(1, seed, 'bag')
+    start = time.perf_counter()
+    for i in range(pieces):
+        if game.game_over:
+            game.reset(1, seed + i)
+        if not bot.play_piece(game):
+            game.drop()
+    elapsed = time.perf_counter() - start
+    return {
+        'ai.placements_per_s': (bot.evaluated / elapsed, 'placements/s'),
+        'ai.pieces_per_s': (pieces / elapsed, 'pieces/s'),
+        'ai.cache_hit_rate': (bot.cache.hit_rate() * 100, '%'),
+    }
+
+
+def bench_snapshot(ticks, seed):
+    # A delta every tick of seeded games with random inputs, as a spectator
+    # stream would send them, then decoding the whole stream
+    rng = random.Random(seed)
+    game = tetris_core.Game(1, seed, 'bag')
+    encoder = SnapshotEncoder(game)
+    stream = [encoder.keyframe()]
+    encode = 0.0
+    for i in range(ticks):
+        if game.game_over:
+            game.reset(1, seed + i)
+            stream.append(encoder.keyframe())
+        if rng.random() < 0.2:
+            game.apply(rng.choice((LEFT, RIGHT, ROTATE)))
+        game.step()
+        start = time.perf_counter()
+        delta = encoder.delta()
+        encode += time.perf_counter() - start
+        if delta is not None:
+            stream.append(delta)
+
+    def decode():
+        mirror = GameMirror()
+        for message in stream:
+            mirror.apply(message)
+    return {
+        'snapshot.encode_per_s': (ticks / encode, 'ticks/s'),
+        'snapshot.decode_per_s': (len(stream) / best_of(5, decode), 'messages/s'),
+        'snapshot.bytes_per_tick': (sum(map(len, stream)) / ticks, 'bytes'),
+    }
+
+
+def bench_numpy(boards, seed):
+    # Batched evaluation of many boards at once; skipped without NumPy
+    try:
+        import tetris_numpy
+    except ImportError:
+        return {}
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(boards):
+        # Random stacks up to half the board tall, one gap per row
+        height = rng.randrange(GRID_HEIGHT // 2)
+        rows.append([0] * (GRID_HEIGHT - height) +
+                    [FULL_ROW ^ (1 << rng.randrange(GRID_WIDTH)) for _ in range(height)])
+    batch = tetris_numpy.from_rows(rows)
+    evaluate = best_of(5, lambda: tetris_numpy.evaluate(batch, 0))
+    drop = best_of(5, lambda: tetris_numpy.drop_and_place(batch, 0, 1, 3))
+    return {
+        'numpy.evaluate_per_s': (boards / evaluate, 'boards/s'),
+        'numpy.drop_place_per_s': (boards / drop, 'boards/s'),
+    }
+
+
+def bench_render(frames, seed):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame
+    except ImportError:
+        return {}
+    import tetris
+
+    pygame.init()
+    screen = pygame.display.set_mode((tetris.SCREEN_WIDTH, tetris.SCREEN_HEIGHT))
+    results = {}
+    for mode in ('full', 'incremental'):
+        game = tetris.Game(screen)
+        game.in_level_selection = False
+        game.reset(1, seed)
+        rng = random.Random(seed)
+        game.draw_grid()
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            if game.game_over:
+                game.reset(1, seed)
+            if rng.random() < 0.2:
+                game.apply(rng.choice((LEFT, RIGHT, ROTATE)))
+            game.advance(1)
+            if mode == 'full':
+                game.invalidate()
+            game.draw_grid()
+        elapsed = time.perf_counter() - start
+        results[f'render.{mode}_frames_per_s'] = (frames / elapsed, 'frames/s')
+    pygame.quit()
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run(games=200, frames=600, seed=0, render=True):
+    results = {}
+    for board in BOARDS:
+        results.update(bench_games(board, games, seed))
+        results.update(bench_ops(board, seed))
+    results.update(bench_ai(100, seed))
+    results.update(bench_snapshot(20000, seed))
+    results.update(bench_numpy(10000, seed))
+    if render:
+        results.update(bench_render(frames, seed))
+    return {
+        'meta': metadata(),
+        'results': {name: {'value': value, 'unit': unit}
+                    for name, (value, unit) in results.items()},
+    }
+
+
+def report(data, baseline=None):
+    for name, result in sorted(data['results'].items()):
+        line = f"{name:40} {result['value']:14.1f} {result['unit']}"
+        if baseline is not None and name in baseline['results']:
+            old = baseline['results'][name]['value']
+            line += f"  ({result['value'] / old:.2f}x vs {baseline['meta'].get('commit')})"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris engine and rendering benchmarks")
+    parser.add_argument('--games', type=int, default=200, help="seeded games per board")
+    parser.add_argument('--frames', type=int, default=600, help="frames per render mode")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-render', action='store_true', help="skip pygame rendering")
+    parser.add_argument('--output', metavar='FILE', help="write results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="show ratios against an earlier JSON run")
+    args = parser.parse_args(argv)
+
+    data = run(args.games, args.frames, args.seed, not args.no_render)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(data, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
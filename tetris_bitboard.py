@@ -0,0 +1,171 @@
+import tetris_core
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, ROTATIONS
+
+# Compact board mode: the whole board is one integer. Row y takes STRIDE
+# bits starting at (y + TOP) * STRIDE, bit x for column x and one more bit
+# for a wall on its right; that wall bit is also what column -1 of the row
+# below wraps onto. TOP empty rows sit above the board and FLOOR full rows
+# below it. With walls and floor in the board, a piece is a precomputed
+# mask shifted to its position, and a collision check is a single AND.
+# Cells only record occupancy, not which shape filled them.
+
+FULL_ROW = (1 << GRID_WIDTH) - 1
+STRIDE = GRID_WIDTH + 1
+TOP = 4  # Rows above the board, for pieces not yet all the way in
+FLOOR = 4  # Full rows below it, as deep as any piece reaches
+WALLS = sum(1 << ((y + TOP) * STRIDE + GRID_WIDTH) for y in range(-TOP, GRID_HEIGHT + FLOOR))
+BORDER = WALLS | sum(FULL_ROW << ((y + TOP) * STRIDE) for y in range(GRID_HEIGHT, GRID_HEIGHT + FLOOR))
+CELLS = sum(FULL_ROW << ((y + TOP) * STRIDE) for y in range(GRID_HEIGHT))
+ROW_ONES = sum(1 << ((y + TOP) * STRIDE) for y in range(GRID_HEIGHT))
+# One bit per row in column 0, shifted over to pick out a column
+COLUMN = sum(1 << (y * STRIDE) for y in range(TOP + GRID_HEIGHT + FLOOR))
+
+
+def _build_piece_masks():
+    # PIECE_MASKS[shape_index][rotation][x] is a tuple of row masks (top to
+    # bottom) for the piece with its left edge at column x, or None if the
+    # piece would stick out of the side walls there.
+    masks = []
+    for orientations in ROTATIONS:
+        shape_masks = []
+        for rotation in orientations:
+            row_masks = [sum(1 << c for c, cell in enumerate(row) if cell)
+                         for row in rotation.shape]
+            columns = []
+            for x in range(GRID_WIDTH):
+                if x + rotation.width > GRID_WIDTH:
+                    columns.append(None)
+                else:
+                    columns.append(tuple(m << x for m in row_masks))
+            shape_masks.append(tuple(columns))
+        masks.append(tuple(shape_masks))
+    return tuple(masks)
+
+
+PIECE_MASKS = _build_piece_masks()
+
+# PIECE_BITS[shape_index][rotation] is the piece as board bits with its top
+# left corner at (0, -TOP); shifting it left by offset(x, y) moves it to
+# (x, y). Every column of a piece has a cell, so one standing out of either
+# side always overlaps a wall bit.
+PIECE_BITS = tuple(tuple(sum(1 << (y * STRIDE + x) for x, y in rotation.cells)
+                         for rotation in orientations)
+                   for orientations in ROTATIONS)
+
+
+def offset(x, y):
+    return (y + TOP) * STRIDE + x
+
+
+class BitBoard:
+    def __init__(self):
+        self.bits = BORDER
+
+    @property
+    def rows(self):
+        # The board as one integer per row, bit x set when column x is filled
+        bits = self.bits
+        return [bits >> offset(0, y) & FULL_ROW for y in range(GRID_HEIGHT)]
+
+    def drop_y(self, shape_index, rotation, x, y):
+        # Lowest row the piece reaches falling straight down from y: the
+        # least distance from a column's lowest cell to the first filled
+        # cell under it, which the floor guarantees
+        bits = self.bits
+        distance = TOP + GRID_HEIGHT
+        for column, bottom in enumerate(ROTATIONS[shape_index][rotation].bottoms):
+            below = bits >> offset(x + column, y + bottom + 1) & COLUMN
+            distance = min(distance, ((below & -below).bit_length() - 1) // STRIDE)
+        return y + distance
+
+    def lock(self, shape_index, rotation, x, y):
+        # OR the piece into the board; False if it sticks out above the top
+        if y < 0:
+            return False
+        self.bits |= PIECE_BITS[shape_index][rotation] << offset(x, y)
+        return True
+
+    def clear_full_rows(self, top=0, bottom=GRID_HEIGHT):
+        # Only rows in [top, bottom) can have been completed by the last
+        # lock. Adding one to every row carries into its wall bit exactly
+        # when the row is full, so a single addition finds them all. Top
+        # down, each run of full rows is cut out in one go and everything
+        # above it moves down; rows below are left where they are.
+        top, bottom = max(top, 0), min(bottom, GRID_HEIGHT)
+        if top >= bottom:
+            return 0
+        bits = self.bits
+        full = ((bits & CELLS) + ROW_ONES) & WALLS & ((1 << offset(0, bottom)) - (1 << offset(0, top)))
+        count = 0
+        while full:
+            wall = full & -full
+            run = 1
+            while full & wall << run * STRIDE:
+                run += 1
+            full &= ~((wall << run * STRIDE) - wall)
+            start = wall.bit_length() - STRIDE
+            end = start + run * STRIDE
+            bits = bits >> end << end | (bits & ((1 << start) - 1)) << run * STRIDE
+            count += run
+        if count:
+            # The top rows' walls went down with the rest
+            self.bits = bits | WALLS
+        return count
+
+    def add_garbage(self, count, gap):
+        # Push count rows, full except for column gap, up from the bottom;
+        # True if blocks were pushed out of the top
+        cells = self.bits & CELLS
+        overflow = cells >> offset(0, 0) & ((1 << count * STRIDE) - 1) != 0
+        garbage = sum((FULL_ROW ^ (1 << gap)) << offset(0, y)
+                      for y in range(max(GRID_HEIGHT - count, 0), GRID_HEIGHT))
+        self.bits = BORDER | (cells >> count * STRIDE & CELLS) | garbage
+        return overflow
+
+    def fill(self, x, y):
+        self.bits |= 1 << offset(x, y)
+
+    def to_grid(self):
+        return [[(row >> x) & 1 for x in range(GRID_WIDTH)] for row in self.rows]
+
+
+class BitBoardGame(tetris_core.Game):
+    # Same rules as tetris_core.Game, backed by a BitBoard instead of a grid
+    # of shape ids. Meant for bots, replays and other headless workloads.
+
+    def clear_board(self):
+        self.board = BitBoard()
+
+    @property
+    def grid(self):
+        return self.board.to_grid()
+
+    def collision(self, piece, dx=0, dy=0, rotation=None):
+        if rotation is None:
+            rotation = piece.rotation
+        # offset() written out; this is the engine's hottest call
+        return self.board.bits & PIECE_BITS[piece.shape_index][rotation] << \
+            ((piece.y + dy + TOP) * STRIDE + piece.x + dx) != 0
+
+    def drop(self):
+        piece = self.current_piece
+        piece.y = self.board.drop_y(piece.shape_index, piece.rotation, piece.x, piece.y)
+        self.lock_piece()
+
+    def lock_piece(self):
+        piece = self.current_piece
+        if not self.board.lock(piece.shape_index, piece.rotation, piece.x, piece.y):
+            self.game_over = True
+            return
+
+        height = ROTATIONS[piece.shape_index][piece.rotation].height
+        self.score_lines(self.board.clear_full_rows(piece.y, piece.y + height))
+        self.spawn_next()
+
+    def clear_lines(self, top=0, bottom=GRID_HEIGHT):
+        return self.board.clear_full_rows(top, bottom)
+
+    def add_garbage(self, count, gap):
+        if self.board.add_garbage(count, gap) or self.collision(self.current_piece):
+            self.game_over = True
+        return not self.game_over
@@ -0,0 +1,438 @@
+import random
+import time
+from collections import deque, namedtuple
+from itertools import islice
+
+# Headless game rules shared by tetris.py (pygame) and tetris_kivy.py (kivy).
+# Nothing here imports a renderer, so games can be simulated without a window.
+
+# Constants
+GRID_WIDTH = 10
+GRID_HEIGHT = 20
+TICK_RATE = 60  # Simulation ticks per second
+TICK = 1 / TICK_RATE
+
+# Tetrimino shapes
+SHAPES = [
+    [[1, 1, 1, 1]],  # I
+    [[1, 1], [1, 1]],  # O
+    [[1, 1, 1], [0, 1, 0]],  # T
+    [[1, 1, 1], [1, 0, 0]],  # J
+    [[1, 1, 1], [0, 0, 1]],  # L
+    [[0, 1, 1], [1, 1, 0]],  # S
+    [[1, 1, 0], [0, 1, 1]]   # Z
+]
+
+# Player actions, shared by input handling, replays and bots
+LEFT, RIGHT, DOWN, ROTATE, DROP = range(5)
+ACTIONS = (LEFT, RIGHT, DOWN, ROTATE, DROP)
+
+# Grid cells hold 0 for empty or shape_index + 1 for a locked block, so front
+# ends can map a cell to their own colors or textures.
+EMPTY = 0
+EMPTY_ROW = (EMPTY,) * GRID_WIDTH
+GARBAGE = len(SHAPES) + 1  # Rows pushed up by an opponent in versus play
+
+
+def fall_speed_for_level(level):
+    # Seconds per grid cell
+    return max(0.05, 0.5 - (level - 1) * 0.05)
+
+
+def fall_ticks_for_level(level):
+    # Simulation ticks per grid cell
+    return max(1, round(fall_speed_for_level(level) * TICK_RATE))
+
+
+def empty_grid():
+    return [[EMPTY for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+
+
+def _rotate_shape(shape):
+    # Transpose the matrix and reverse each row for clockwise rotation
+    rows = len(shape)
+    cols = len(shape[0])
+    rotated = [[0 for _ in range(rows)] for _ in range(cols)]
+
+    for r in range(rows):
+        for c in range(cols):
+            rotated[c][rows - 1 - r] = shape[r][c]
+    return rotated
+
+
+# One orientation of a shape: the cell matrix, the (x, y) offsets of its
+# filled cells relative to the piece's top-left corner, its size, and the
+# row offset of the lowest cell in each of its columns.
+Rotation = namedtuple('Rotation', 'shape cells width height bottoms')
+
+
+def _build_rotations():
+    table = []
+    for shape in SHAPES:
+        orientations = []
+        for _ in range(4):
+            cells = tuple((x, y) for y, row in enumerate(shape)
+                          for x, cell in enumerate(row) if cell)
+            bottoms = tuple(max(y for x, y in cells if x == column)
+                            for column in range(len(shape[0])))
+            orientations.append(Rotation(tuple(tuple(row) for row in shape),
+                                         cells, len(shape[0]), len(shape), bottoms))
+            shape = _rotate_shape(shape)
+        table.append(tuple(orientations))
+    return tuple(table)
+
+
+# ROTATIONS[shape_index][rotation], built once; rotation 0 is the spawn
+# orientation and each step is a clockwise turn.
+ROTATIONS = _build_rotations()
+
+
+class Tetrimino:
+    def __init__(self, x, y, shape_index=None):
+        self.x = x
+        self.y = y
+        if shape_index is None:
+            shape_index = random.randint(0, len(SHAPES) - 1)
+        self.shape_index = shape_index
+        self.rotation = 0
+
+    @property
+    def shape(self):
+        return ROTATIONS[self.shape_index][self.rotation].shape
+
+    @property
+    def cells(self):
+        return ROTATIONS[self.shape_index][self.rotation].cells
+
+
+class PieceGenerator:
+    # Per-game source of shape indices. 'uniform' draws each piece
+    # independently like the original random.randint; 'bag' deals shuffled
+    # bags holding each of the 7 shapes once. The same seed and mode always
+    # give the same sequence.
+    MODES = ('uniform', 'bag')
+
+    def __init__(self, seed=None, mode='uniform'):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown piece mode: {mode!r}")
+        self.seed = seed
+        self.mode = mode
+        self.random = random.Random(seed)
+        self.queue = deque()
+
+    def refill(self):
+        if self.mode == 'bag':
+            bag = list(range(len(SHAPES)))
+            self.random.shuffle(bag)
+            self.queue.extend(bag)
+        else:
+            self.queue.append(self.random.randrange(len(SHAPES)))
+
+    def next(self):
+        if not self.queue:
+            self.refill()
+        return self.queue.popleft()
+
+    def peek(self, count):
+        # Upcoming shape indices without consuming them
+        while len(self.queue) < count:
+            self.refill()
+        return list(islice(self.queue, count))
+
+
+class SimulationClock:
+    # Fixed-timestep clock: elapsed real time goes into an accumulator that is
+    # spent in whole TICK steps, so game speed does not depend on frame rate
+    # and leftover time carries over to the next frame.
+    def __init__(self, tick=TICK, max_ticks=TICK_RATE, time_source=time.monotonic):
+        self.tick = tick
+        self.max_ticks = max_ticks  # Catch-up limit per call after a stall
+        self.time_source = time_source
+        self.reset()
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.last_time = self.time_source()
+
+    def advance(self, elapsed=None):
+        # Return how many ticks are due; measures elapsed time if not given
+        if elapsed is None:
+            now = self.time_source()
+            elapsed = now - self.last_time
+            self.last_time = now
+        self.accumulator += elapsed
+
+        ticks = int(self.accumulator / self.tick + 1e-9)
+        if ticks > self.max_ticks:
+            # Too far behind (debugger, suspended app); drop the backlog
+            ticks = self.max_ticks
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= ticks * self.tick
+        return ticks
+
+
+class Game:
+    def __init__(self, level=1, seed=None, piece_mode='uniform'):
+        self.piece_mode = piece_mode
+        self.reset(level, seed)
+
+    def reset(self, level=1, seed=None):
+        # Every game records its seed so it can be replayed; pick one if the
+        # caller did not
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.pieces = PieceGenerator(seed, self.piece_mode)
+        self.clear_board()
+        self.current_piece = self.new_piece()
+        self.next_piece = self.new_piece()
+        self.game_over = False
+        self.score = 0
+        self.level = level
+        self.start_level = level
+        self.lines_cleared = (level - 1) * 10  # Set lines cleared based on level
+        self.fall_speed = fall_speed_for_level(level)  # Adjust speed based on level
+        self.fall_ticks = fall_ticks_for_level(level)
+        self.ticks = 0  # Simulation ticks since reset
+        self.gravity_ticks = 0  # Ticks since the piece last fell
+        self.pieces_locked = 0
+
+    def clear_board(self):
+        self.grid = empty_grid()
+        # Kept up to date on every lock and clear, so hard drops and line
+        # checks never rescan the grid: filled cells per row, column heights
+        # (rows from the bottom up to the column's top block), filled cells
+        # in total and holes (empty cells under a column's top block)
+        self.row_counts = [0] * GRID_HEIGHT
+        self.heights = [0] * GRID_WIDTH
+        self.filled_cells = 0
+        self.holes = 0
+
+    def recount(self):
+        # Rebuild the incremental counts after editing grid directly
+        grid = self.grid
+        self.row_counts = [sum(1 for cell in row if cell) for row in grid]
+        self.heights = [next((GRID_HEIGHT - y for y in range(GRID_HEIGHT) if grid[y][x]), 0)
+                        for x in range(GRID_WIDTH)]
+        self.filled_cells = sum(self.row_counts)
+        self.holes = sum(self.heights) - self.filled_cells
+
+    def new_piece(self):
+        return Tetrimino(GRID_WIDTH // 2 - 1, 0, self.pieces.next())
+
+    def upcoming(self, count):
+        # Shape indices of the next count pieces, starting with next_piece,
+        # for headless look-ahead; the front ends preview only next_piece
+        if count < 1:
+            return []
+        return [self.next_piece.shape_index] + self.pieces.peek(count - 1)
+
+    def collision(self, piece, dx=0, dy=0, rotation=None):
+        if rotation is None:
+            rotation = piece.rotation
+        grid = self.grid
+        px = piece.x + dx
+        py = piece.y + dy
+
+        for x, y in ROTATIONS[piece.shape_index][rotation].cells:
+            pos_x = px + x
+            pos_y = py + y
+
+            # Check if out of bounds
+            if (pos_x < 0 or pos_x >= GRID_WIDTH or
+                pos_y >= GRID_HEIGHT or
+                (pos_y >= 0 and grid[pos_y][pos_x])):
+                return True
+        return False
+
+    def move(self, dx, dy):
+        if not self.collision(self.current_piece, dx, dy):
+            self.current_piece.x += dx
+            self.current_piece.y += dy
+            return True
+        return False
+
+    def rotate(self):
+        rotation = (self.current_piece.rotation + 1) & 3
+
+        # Check if rotation is valid
+        if not self.collision(self.current_piece, 0, 0, rotation):
+            self.current_piece.rotation = rotation
+            return True
+        return False
+
+    def apply(self, action):
+        if self.game_over:
+            return False
+        if action == LEFT:
+            return self.move(-1, 0)
+        elif action == RIGHT:
+            return self.move(1, 0)
+        elif action == DOWN:
+            return self.move(0, 1)
+        elif action == ROTATE:
+            return self.rotate()
+        elif action == DROP:
+            self.drop()
+            return True
+        raise ValueError(f"Unknown action: {action!r}")
+
+    def drop(self):
+        piece = self.current_piece
+        rotation = ROTATIONS[piece.shape_index][piece.rotation]
+        heights = self.heights
+        # With the piece above the stack in every column it covers, it lands
+        # where the first column meets its top block; tucked under an
+        # overhang, fall row by row instead
+        landing = GRID_HEIGHT
+        for column, bottom in enumerate(rotation.bottoms):
+            top = GRID_HEIGHT - heights[piece.x + column]
+            if piece.y + bottom >= top:
+                break
+            landing = min(landing, top - 1 - bottom)
+        else:
+            piece.y = landing
+            self.lock_piece()
+            return
+        while self.move(0, 1):
+            pass
+        self.lock_piece()
+
+    def tick(self):
+        # One gravity step: fall a row or lock in place
+        if self.game_over:
+            return
+        if not self.move(0, 1):
+            self.lock_piece()
+
+    def step(self):
+        # Advance the simulation by one fixed TICK
+        if self.game_over:
+            return
+        self.ticks += 1
+        self.gravity_ticks += 1
+        if self.gravity_ticks >= self.fall_ticks:
+            self.gravity_ticks = 0
+            self.tick()
+
+    def advance(self, ticks):
+        # Run several ticks back to back, e.g. to catch up or run headless
+        for _ in range(ticks):
+            if self.game_over:
+                break
+            self.step()
+
+    def lock_piece(self):
+        if not self.place_piece(self.current_piece):
+            self.game_over = True
+            return
+
+        # Only rows the piece covers can have been completed
+        piece = self.current_piece
+        height = ROTATIONS[piece.shape_index][piece.rotation].height
+        self.score_lines(self.clear_lines(piece.y, piece.y + height))
+        self.spawn_next()
+
+    def place_piece(self, piece):
+        # Write the piece into the grid; False if it sticks out above the top
+        value = piece.shape_index + 1
+        grid = self.grid
+        row_counts = self.row_counts
+        heights = self.heights
+        for x, y in piece.cells:
+            if piece.y + y < 0:
+                return False
+            row = piece.y + y
+            column = piece.x + x
+            grid[row][column] = value
+            row_counts[row] += 1
+            if GRID_HEIGHT - row > heights[column]:
+                self.holes += GRID_HEIGHT - row - heights[column]
+                heights[column] = GRID_HEIGHT - row
+            self.holes -= 1
+        self.filled_cells += len(piece.cells)
+        return True
+
+    def spawn_next(self):
+        # Called once the current piece has locked
+        self.pieces_locked += 1
+        self.current_piece = self.next_piece
+        self.next_piece = self.new_piece()
+
+        # Check if the new piece can be placed
+        if self.collision(self.current_piece):
+            self.game_over = True
+
+    def add_garbage(self, count, gap):
+        # Push count rows, full except for column gap, up from the bottom.
+        # Blocks pushed out of the top, or into the falling piece, end the
+        # game; returns False then.
+        grid = self.grid
+        overflow = any(self.row_counts[:count])
+        # The rows leaving the top are reused as the new bottom rows
+        rows = grid[:count]
+        del grid[:count]
+        for row in rows:
+            row[:] = EMPTY_ROW
+            for x in range(GRID_WIDTH):
+                if x != gap:
+                    row[x] = GARBAGE
+            grid.append(row)
+        self.recount()
+        if overflow or self.collision(self.current_piece):
+            self.game_over = True
+        return not self.game_over
+
+    def clear_lines(self, top=0, bottom=GRID_HEIGHT):
+        # Remove full rows and return how many were cleared; only rows in
+        # [top, bottom) are checked, which is enough after a lock
+        row_counts = self.row_counts
+        lines_to_clear = [y for y in range(max(top, 0), min(bottom, GRID_HEIGHT))
+                          if row_counts[y] == GRID_WIDTH]
+
+        count = len(lines_to_clear)
+        if count:
+            grid = self.grid
+            heights = self.heights
+            stack_top = GRID_HEIGHT - max(heights)
+
+            # One pass from the lowest cleared row up to the top of the
+            # stack moves every kept row down into place; rows above the
+            # stack are empty and stay put. The cleared row lists are
+            # emptied and reused as the new empty rows.
+            freed = [grid[y] for y in lines_to_clear]
+            write = lines_to_clear[-1]
+            for y in range(write, stack_top - 1, -1):
+                if row_counts[y] != GRID_WIDTH:
+                    grid[write] = grid[y]
+                    row_counts[write] = row_counts[y]
+                    write -= 1
+            for y, row in enumerate(freed, stack_top):
+                row[:] = EMPTY_ROW
+                grid[y] = row
+                row_counts[y] = 0
+
+            # A full row has a block in every column, so each column's top is
+            # at or above the first cleared row. Tops above it just move down;
+            # a top that was cleared away is found by looking down from there.
+            first = GRID_HEIGHT - lines_to_clear[0]
+            for x in range(GRID_WIDTH):
+                if heights[x] > first:
+                    heights[x] -= count
+                    continue
+                y = GRID_HEIGHT - heights[x] + count
+                while y < GRID_HEIGHT and not grid[y][x]:
+                    y += 1
+                heights[x] = GRID_HEIGHT - y
+            self.filled_cells -= count * GRID_WIDTH
+            self.holes = sum(heights) - self.filled_cells
+        return count
+
+    def score_lines(self, count):
+        if count:
+            self.lines_cleared += count
+            self.score += (count ** 2) * 100
+            self.level = self.lines_cleared // 10 + 1
+            self.fall_speed = fall_speed_for_level(self.level)
+            self.fall_ticks = fall_ticks_for_level(self.level)
@@ -3,19 +3,21 @@ from kivy.uix.widget import Widget
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.screenmanager import ScreenManager, Screen
-from kivy.graphics import Rectangle, Color
-from kivy.clock import Clock
+from kivy.graphics import Rectangle, Color, Line
+from kivy.clock import Clock, mainthread
 from kivy.core.window import Window
-from kivy.properties import NumericProperty, ListProperty, ObjectProperty
-from kivy.core.image import Image as KivyImage
-import random
+from kivy.graphics.texture import Texture
 import os
+import time
+
+import tetris_core
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, ROTATIONS
+from tetris_core import LEFT, RIGHT, DOWN, ROTATE, DROP
+from tetris_replay import Replay
+from tetris_session import Session
 
 # Constants
-GRID_WIDTH = 10
-GRID_HEIGHT = 20
 CELL_SIZE = 30
 
 # Colors (RGBA format for Kivy)
@@ -30,83 +32,126 @@ MAGENTA = (1, 0, 1, 1)
 YELLOW = (1, 1, 0, 1)
 ORANGE = (1, 0.65, 0, 1)
 
-# Tetrimino shapes
-SHAPES = [
-    [[1, 1, 1, 1]],  # I
-    [[1, 1], [1, 1]],  # O
-    [[1, 1, 1], [0, 1, 0]],  # T
-    [[1, 1, 1], [1, 0, 0]],  # J
-    [[1, 1, 1], [0, 0, 1]],  # L
-    [[0, 1, 1], [1, 1, 0]],  # S
-    [[1, 1, 0], [0, 1, 1]]   # Z
-]
+# tetris_startup.py sets this to time a cold start: the app prints the wall
+# time once the first frame is on screen and exits
+STARTUP_PROBE = 'TETRIS_STARTUP_PROBE'
+
+# Keys that map to player actions during play
+KEY_ACTIONS = {
+    'left': LEFT,
+    'right': RIGHT,
+    'down': DOWN,
+    'up': ROTATE,
+    'spacebar': DROP,
+}
 
-# Colors for each shape
+# Colors for each shape, indexed by shape_index (grid cells store shape_index + 1)
 SHAPE_COLORS = [CYAN, YELLOW, MAGENTA, BLUE, ORANGE, GREEN, RED]
 
-# Load textures
+# Block texture for each shape, indexed by shape_index; three images are
+# shared between the seven shapes
 TEXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'texturs')
-
-# Available textures
-TEXTURES = [
-    KivyImage(os.path.join(TEXTURE_PATH, 'retengle.jpg')).texture,
-    KivyImage(os.path.join(TEXTURE_PATH, 'Untitled design (1).jpg')).texture,
-    KivyImage(os.path.join(TEXTURE_PATH, 'Untitled design (2).jpg')).texture,
-    # Reuse textures for the remaining shapes
-    KivyImage(os.path.join(TEXTURE_PATH, 'retengle.jpg')).texture,
-    KivyImage(os.path.join(TEXTURE_PATH, 'Untitled design (1).jpg')).texture,
-    KivyImage(os.path.join(TEXTURE_PATH, 'Untitled design (2).jpg')).texture,
-    KivyImage(os.path.join(TEXTURE_PATH, 'retengle.jpg')).texture,
+TEXTURE_FILES = [
+    'retengle.jpg',
+    'Untitled design (1).jpg',
+    'Untitled design (2).jpg',
+    'retengle.jpg',
+    'Untitled design (1).jpg',
+    'Untitled design (2).jpg',
+    'retengle.jpg',
 ]
 
-class Tetrimino:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.shape_index = random.randint(0, len(SHAPES) - 1)
-        self.shape = SHAPES[self.shape_index]
-        self.color = SHAPE_COLORS[self.shape_index]
-        self.texture = TEXTURES[self.shape_index]
-        self.rotation = 0
-    
-    def rotate(self, grid):
-        # Transpose the matrix and reverse each row for clockwise rotation
-        rows = len(self.shape)
-        cols = len(self.shape[0])
-        rotated = [[0 for _ in range(rows)] for _ in range(cols)]
-        
-        for r in range(rows):
-            for c in range(cols):
-                rotated[c][rows - 1 - r] = self.shape[r][c]
-        
-        # Check if rotation is valid
-        if not self.collision(0, 0, rotated, grid):
-            self.shape = rotated
-    
-    def collision(self, dx=0, dy=0, shape=None, grid=None):
-        if shape is None:
-            shape = self.shape
-        
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    pos_x = self.x + x + dx
-                    pos_y = self.y + y + dy
-                    
-                    # Check if out of bounds
-                    if (pos_x < 0 or pos_x >= GRID_WIDTH or 
-                        pos_y >= GRID_HEIGHT or 
-                        (pos_y >= 0 and grid[pos_y][pos_x])):
-                        return True
-        return False
+
+class TextureAtlas:
+    # All block textures packed side by side into one small texture, built on
+    # first use rather than at import. Each unique file is decoded once on the
+    # CPU (never uploaded at full size), box-sampled down to cell size and
+    # copied into its slot; shapes get regions of the shared texture, so every
+    # cell draws from the same texture binding.
+    SAMPLES = 2  # Source pixels sampled per atlas pixel, in each direction
+
+    def __init__(self, files, cell_size=CELL_SIZE):
+        self.files = files
+        self.cell_size = cell_size
+        self.texture = None
+        self.regions = None
+        self.pixels = None
+
+    def region(self, shape_index):
+        if self.regions is None:
+            self.load()
+        return self.regions[shape_index]
+
+    def load(self):
+        unique = list(dict.fromkeys(self.files))
+        size = self.cell_size
+        width = size * len(unique)
+        pixels = bytearray(width * size * 4)
+        for slot, name in enumerate(unique):
+            self.pack(pixels, width, slot * size, os.path.join(TEXTURE_PATH, name))
+        self.pixels = bytes(pixels)
+
+        self.texture = Texture.create(size=(width, size), colorfmt='rgba')
+        # GL textures are lost when an Android app is paused; upload again
+        self.texture.add_reload_observer(self.upload)
+        self.upload(self.texture)
+        self.regions = [self.texture.get_region(unique.index(name) * size, 0, size, size)
+                        for name in self.files]
+
+    def pack(self, pixels, width, left, path):
+        # Image providers load on first import; not needed before a game starts
+        from kivy.core.image import Image as KivyImage, ImageLoader
+        image = KivyImage(ImageLoader.load(path, keep_data=True, nocache=True))
+        size = self.cell_size
+        samples = self.SAMPLES
+        step_x = image.width / (size * samples)
+        step_y = image.height / (size * samples)
+        for row in range(size):
+            # Texture rows run bottom to top, image rows top to bottom
+            top = (size - 1 - row) * samples
+            for column in range(size):
+                total = [0.0, 0.0, 0.0, 0.0]
+                for sy in range(samples):
+                    for sx in range(samples):
+                        color = image.read_pixel(int((column * samples + sx + 0.5) * step_x),
+                                                 int((top + sy + 0.5) * step_y))
+                        for channel, value in enumerate(color):
+                            total[channel] += value
+                if len(color) == 3:
+                    total[3] = samples * samples
+                offset = (row * width + left + column) * 4
+                pixels[offset:offset + 4] = bytes(int(value * 255 / (samples * samples) + 0.5)
+                                                  for value in total)
+
+    def upload(self, texture):
+        texture.blit_buffer(self.pixels, colorfmt='rgba', bufferfmt='ubyte')
+
+
+TEXTURES = TextureAtlas(TEXTURE_FILES)
 
 class TetrisGrid(Widget):
     def __init__(self, **kwargs):
         super(TetrisGrid, self).__init__(**kwargs)
-        self.grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+        self.game = None
         self.size = (GRID_WIDTH * CELL_SIZE, GRID_HEIGHT * CELL_SIZE)
-        self.current_piece = None
-        self.next_piece = None
+        
+        # Fixed pool of one Color and one Rectangle per cell, created once and
+        # updated in place; hidden cells have zero alpha
+        self.cell_colors = []
+        self.cell_rects = []
+        self.drawn_cells = [tetris_core.EMPTY] * (GRID_WIDTH * GRID_HEIGHT)
+        with self.canvas:
+            for i in range(GRID_WIDTH * GRID_HEIGHT):
+                self.cell_colors.append(Color(0, 0, 0, 0))
+                self.cell_rects.append(Rectangle(size=(CELL_SIZE, CELL_SIZE)))
+            
+            # Ghost outline of the hinted placement, one line per block
+            self.ghost_color = Color(0, 0, 0, 0)
+            self.ghost_lines = [Line(rectangle=(0, 0, CELL_SIZE, CELL_SIZE), width=1.5)
+                                for _ in range(4)]
+        self.hints = None  # The screen's HintWorker while hints are on
+        self.drawn_hint = None
+        
         self.bind(pos=self.update_rect, size=self.update_rect)
         self.update_rect()
     
@@ -125,46 +170,59 @@ class TetrisGrid(Widget):
             for y in range(GRID_HEIGHT + 1):
                 Rectangle(pos=(self.pos[0], self.pos[1] + y * CELL_SIZE), 
                           size=(self.width, 1))
+        
+        # Move the cell pool along with the widget
+        for i, rect in enumerate(self.cell_rects):
+            y, x = divmod(i, GRID_WIDTH)
+            rect.pos = (self.pos[0] + x * CELL_SIZE, 
+                        self.pos[1] + (GRID_HEIGHT - 1 - y) * CELL_SIZE)
+        self.drawn_hint = None
     
     def draw(self):
-        self.canvas.clear()
+        if self.game is None:
+            return
         
-        # Draw locked pieces
-        for y in range(GRID_HEIGHT):
-            for x in range(GRID_WIDTH):
-                if self.grid[y][x]:
-                    with self.canvas:
-                        # Use texture if it's a tuple containing texture
-                        if isinstance(self.grid[y][x], tuple) and len(self.grid[y][x]) == 2:
-                            texture, color = self.grid[y][x]
-                            Color(*color)
-                            Rectangle(pos=(self.pos[0] + x * CELL_SIZE, 
-                                        self.pos[1] + (GRID_HEIGHT - 1 - y) * CELL_SIZE), 
-                                    size=(CELL_SIZE, CELL_SIZE),
-                                    texture=texture)
-                        else:
-                            # Fallback to color only
-                            Color(*self.grid[y][x])
-                            Rectangle(pos=(self.pos[0] + x * CELL_SIZE, 
-                                        self.pos[1] + (GRID_HEIGHT - 1 - y) * CELL_SIZE), 
-                                    size=(CELL_SIZE, CELL_SIZE))
-        
-        # Draw current piece
-        if self.current_piece:
-            for y, row in enumerate(self.current_piece.shape):
-                for x, cell in enumerate(row):
-                    if cell:
-                        with self.canvas:
-                            Color(*self.current_piece.color)
-                            Rectangle(pos=(self.pos[0] + (self.current_piece.x + x) * CELL_SIZE, 
-                                        self.pos[1] + (GRID_HEIGHT - 1 - (self.current_piece.y + y)) * CELL_SIZE), 
-                                    size=(CELL_SIZE, CELL_SIZE),
-                                    texture=self.current_piece.texture)
+        # Locked blocks plus the falling piece, one value per cell
+        cells = [value for row in self.game.grid for value in row]
+        piece = self.game.current_piece
+        if piece:
+            for x, y in piece.cells:
+                if piece.y + y >= 0:
+                    cells[(piece.y + y) * GRID_WIDTH + piece.x + x] = piece.shape_index + 1
+        
+        # Update only the instructions of cells that changed
+        drawn = self.drawn_cells
+        for i, value in enumerate(cells):
+            if value != drawn[i]:
+                if value:
+                    self.cell_colors[i].rgba = SHAPE_COLORS[value - 1]
+                    self.cell_rects[i].texture = TEXTURES.region(value - 1)
+                else:
+                    self.cell_colors[i].a = 0
+        self.drawn_cells = cells
+        
+        # The ghost only moves when the worker publishes a new hint
+        hint = self.hints.hint if self.hints is not None else None
+        if hint is not None and hint.piece is not piece:
+            hint = None
+        if hint is not self.drawn_hint:
+            self.drawn_hint = hint
+            if hint is None:
+                self.ghost_color.a = 0
+            else:
+                placement = hint.placement
+                rotation = ROTATIONS[piece.shape_index][placement.rotation]
+                self.ghost_color.rgba = SHAPE_COLORS[piece.shape_index]
+                for line, (x, y) in zip(self.ghost_lines, rotation.cells):
+                    line.rectangle = (self.pos[0] + (placement.x + x) * CELL_SIZE, 
+                                      self.pos[1] + (GRID_HEIGHT - 1 - placement.y - y) * CELL_SIZE, 
+                                      CELL_SIZE, CELL_SIZE)
 
 class NextPieceWidget(Widget):
     def __init__(self, **kwargs):
         super(NextPieceWidget, self).__init__(**kwargs)
         self.next_piece = None
+        self.drawn_piece = None
         self.size = (4 * CELL_SIZE, 4 * CELL_SIZE)
         self.bind(pos=self.update_rect, size=self.update_rect)
         self.update_rect()
@@ -177,26 +235,33 @@ class NextPieceWidget(Widget):
             
             Color(1, 1, 1, 1)
             Rectangle(pos=self.pos, size=self.size, width=1.5)
+        
+        # Geometry changed, so the preview has to be rebuilt
+        self.drawn_piece = None
+        self.draw()
     
     def draw(self):
+        # The preview only changes when the next piece does
+        if self.drawn_piece is self.next_piece:
+            return
+        self.drawn_piece = self.next_piece
         self.canvas.clear()
         
         if self.next_piece:
-            shape_width = len(self.next_piece.shape[0]) * CELL_SIZE
-            shape_height = len(self.next_piece.shape) * CELL_SIZE
+            rotation = ROTATIONS[self.next_piece.shape_index][self.next_piece.rotation]
+            shape_width = rotation.width * CELL_SIZE
+            shape_height = rotation.height * CELL_SIZE
             
             center_x = self.pos[0] + (self.width - shape_width) / 2
             center_y = self.pos[1] + (self.height - shape_height) / 2
             
-            for y, row in enumerate(self.next_piece.shape):
-                for x, cell in enumerate(row):
-                    if cell:
-                        with self.canvas:
-                            Color(*self.next_piece.color)
-                            Rectangle(pos=(center_x + x * CELL_SIZE, 
-                                          center_y + (len(self.next_piece.shape) - 1 - y) * CELL_SIZE), 
-                                     size=(CELL_SIZE, CELL_SIZE),
-                                     texture=self.next_piece.texture)
+            with self.canvas:
+                Color(*SHAPE_COLORS[self.next_piece.shape_index])
+                for x, y in rotation.cells:
+                    Rectangle(pos=(center_x + x * CELL_SIZE, 
+                                  center_y + (rotation.height - 1 - y) * CELL_SIZE), 
+                             size=(CELL_SIZE, CELL_SIZE),
+                             texture=TEXTURES.region(self.next_piece.shape_index))
 
 class LevelSelectionScreen(Screen):
     def __init__(self, **kwargs):
@@ -215,8 +280,8 @@ class LevelSelectionScreen(Screen):
         select_label = Label(text='Select Starting Level (1-10):', font_size=24, size_hint=(1, 0.1))
         layout.add_widget(select_label)
         
-        # Level buttons
-        level_layout = GridLayout(cols=10, spacing=5, size_hint=(1, 0.2))
+        # Level buttons, all in one row
+        level_layout = BoxLayout(orientation='horizontal', spacing=5, size_hint=(1, 0.2))
         self.level_buttons = []
         
         for i in range(1, 11):
@@ -257,40 +322,45 @@ class LevelSelectionScreen(Screen):
         self.manager.current = 'game'
 
 class GameScreen(Screen):
-    def __init__(self, **kwargs):
+    def __init__(self, record_dir=None, profiler=None, scores_path=False, hint=False, **kwargs):
         super(GameScreen, self).__init__(**kwargs)
-        self.game_over = False
-        self.score = 0
-        self.level = 1
-        self.lines_cleared = 0
-        self.fall_speed = 0.5  # seconds per grid cell
-        self.last_fall_time = 0
+        self.profiler = profiler
+        self.game = tetris_core.Game()
+        self.game.game_over = True  # No game running until start_game
+        # Coalesce redraws requested by input and gravity into one per frame
+        self.redraw_trigger = Clock.create_trigger(self.redraw)
+        # Results and hints arrive on worker threads; mainthread moves them
+        # to Kivy's. scores_path None means the app's data directory.
+        self.session = Session(self.game, record_dir, scores_path,
+                               on_results=lambda results: results.add_done_callback(self.show_results),
+                               on_hint=mainthread(self.redraw_trigger))
+        self.gravity_event = None
+        self.scheduled_fall_ticks = None
+        self.sim_clock = tetris_core.SimulationClock()
         self.create_layout()
+        self.grid.game = self.game
         
         # Set up keyboard
         self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
         self._keyboard.bind(on_key_down=self._on_keyboard_down)
+        if hint:
+            self.toggle_hints()
     
     def _keyboard_closed(self):
         self._keyboard.unbind(on_key_down=self._on_keyboard_down)
         self._keyboard = None
     
     def _on_keyboard_down(self, keyboard, keycode, text, modifiers):
-        if self.game_over:
+        if not self.playing:
             if keycode[1] == 'r':
                 self.manager.current = 'level_selection'
             return True
+        if keycode[1] == 'h':
+            self.toggle_hints()
+            return True
         
-        if keycode[1] == 'left':
-            self.move(-1, 0)
-        elif keycode[1] == 'right':
-            self.move(1, 0)
-        elif keycode[1] == 'down':
-            self.move(0, 1)
-        elif keycode[1] == 'up':
-            self.current_piece.rotate(self.grid.grid)
-        elif keycode[1] == 'spacebar':
-            self.drop()
+        if keycode[1] in KEY_ACTIONS and self.session.input(KEY_ACTIONS[keycode[1]]):
+            self.sync_state()
         return True
     
     def create_layout(self):
@@ -325,6 +395,17 @@ class GameScreen(Screen):
                                    font_size=36, halign='center', opacity=0)
         right_layout.add_widget(self.game_over_label)
         
+        # Leaderboard for the starting level, filled in after game over
+        self.results_label = Label(text='', font_size=18, halign='center', opacity=0)
+        right_layout.add_widget(self.results_label)
+        
+        # Profiling overlay, only when profiling was asked for
+        if self.profiler:
+            self.profile_label = Label(text='', font_size=14, halign='left', 
+                                       color=GREEN, size_hint=(1, 0.4))
+            right_layout.add_widget(self.profile_label)
+            Clock.schedule_interval(self.update_profile_label, 0.5)
+        
         # Add all layouts
         layout.add_widget(left_layout)
         layout.add_widget(self.grid)
@@ -332,111 +413,177 @@ class GameScreen(Screen):
         
         self.add_widget(layout)
     
-    def start_game(self, level):
+    def start_game(self, level, replay=None):
         # Reset game state
-        self.grid.grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-        self.game_over = False
-        self.score = 0
-        self.level = level
-        self.lines_cleared = (level - 1) * 10
-        self.fall_speed = max(0.05, 0.5 - (level - 1) * 0.05)
+        session = self.session
+        if replay is not None:
+            session.start_replay(replay)
+        else:
+            if session.scores_path is None:
+                # The app's data directory is writable on mobile too
+                session.scores_path = os.path.join(App.get_running_app().user_data_dir, 'scores.db')
+            session.start(level)
         
         # Reset labels
-        self.score_label.text = f'Score: {self.score}'
-        self.level_label.text = f'Level: {self.level}'
-        self.lines_label.text = f'Lines: {self.lines_cleared}'
+        self.update_labels()
         self.game_over_label.opacity = 0
-        
-        # Create initial pieces
-        self.grid.current_piece = self.new_piece()
-        self.grid.next_piece = self.new_piece()
-        self.next_piece_widget.next_piece = self.grid.next_piece
+        self.results_label.opacity = 0
+        self.next_piece_widget.next_piece = self.game.next_piece
         
         # Start game loop
-        Clock.unschedule(self.update)
-        Clock.schedule_interval(self.update, 1/60)
+        self.sim_clock.reset()
+        self.schedule_gravity()
+        self.redraw_trigger()
     
-    def new_piece(self):
-        return Tetrimino(GRID_WIDTH // 2 - 1, 0)
+    @property
+    def playing(self):
+        return self.session.playing
     
-    def move(self, dx, dy):
-        if not self.grid.current_piece.collision(dx, dy, None, self.grid.grid):
-            self.grid.current_piece.x += dx
-            self.grid.current_piece.y += dy
-            return True
-        return False
+    def schedule_gravity(self):
+        # Wake up only when the piece is next due to fall, not every frame;
+        # during a replay also when its next input is due
+        self.stop_gravity()
+        self.scheduled_fall_ticks = self.game.fall_ticks
+        ticks_left = self.game.fall_ticks - self.game.gravity_ticks
+        player = self.session.player
+        if player is not None and player.index < len(player.replay.events):
+            ticks_left = min(ticks_left, player.replay.events[player.index][0] - self.game.ticks)
+        delay = max(0, ticks_left * tetris_core.TICK - self.sim_clock.accumulator)
+        self.gravity_event = Clock.schedule_once(self.update, delay)
+    
+    @mainthread
+    def show_results(self, future):
+        # Called on the score store's thread; mainthread moves it to Kivy's
+        if future is not self.session.results or future.exception() is not None:
+            return
+        top, stats = future.result()
+        lines = [f'Best from level {self.game.start_level}']
+        lines += [f'{rank}. {result.score}' for rank, result in enumerate(top, 1)]
+        if stats is not None:
+            lines += ['', f'Games: {stats.games}', f'Avg score: {stats.mean_score:.0f}',
+                      f'Avg lines: {stats.mean_lines:.1f}']
+        self.results_label.text = '\n'.join(lines)
+        self.results_label.opacity = 1
     
-    def drop(self):
-        while self.move(0, 1):
-            pass
-        self.lock_piece()
+    def stop_gravity(self):
+        if self.gravity_event is not None:
+            self.gravity_event.cancel()
+            self.gravity_event = None
     
-    def lock_piece(self):
-        for y, row in enumerate(self.grid.current_piece.shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    if self.grid.current_piece.y + y < 0:
-                        self.game_over = True
-                        self.game_over_label.opacity = 1
-                        Clock.unschedule(self.update)
-                        return
-                    self.grid.grid[self.grid.current_piece.y + y][self.grid.current_piece.x + x] = (self.grid.current_piece.texture, self.grid.current_piece.color)
-        
-        self.clear_lines()
-        self.grid.current_piece = self.grid.next_piece
-        self.grid.next_piece = self.new_piece()
-        self.next_piece_widget.next_piece = self.grid.next_piece
-        
-        # Check if the new piece can be placed
-        if self.grid.current_piece.collision(0, 0, None, self.grid.grid):
-            self.game_over = True
+    def update_labels(self):
+        self.score_label.text = f'Score: {self.game.score}'
+        self.level_label.text = f'Level: {self.game.level}'
+        self.lines_label.text = f'Lines: {self.game.lines_cleared}'
+    
+    def sync_state(self):
+        # Reflect engine state changes in the widgets
+        self.update_labels()
+        self.next_piece_widget.next_piece = self.game.next_piece
+        if not self.playing:
             self.game_over_label.opacity = 1
-            Clock.unschedule(self.update)
+            self.stop_gravity()
+        elif self.game.fall_ticks != self.scheduled_fall_ticks:
+            self.schedule_gravity()
+        self.redraw_trigger()
     
-    def clear_lines(self):
-        lines_to_clear = []
-        for y in range(GRID_HEIGHT):
-            if all(self.grid.grid[y]):
-                lines_to_clear.append(y)
-        
-        if lines_to_clear:
-            for line in lines_to_clear:
-                del self.grid.grid[line]
-                self.grid.grid.insert(0, [0 for _ in range(GRID_WIDTH)])
-            
-            self.lines_cleared += len(lines_to_clear)
-            self.score += (len(lines_to_clear) ** 2) * 100
-            self.level = self.lines_cleared // 10 + 1
-            self.fall_speed = max(0.05, 0.5 - (self.level - 1) * 0.05)
-            
-            # Update labels
-            self.score_label.text = f'Score: {self.score}'
-            self.level_label.text = f'Level: {self.level}'
-            self.lines_label.text = f'Lines: {self.lines_cleared}'
+    def toggle_hints(self):
+        self.grid.hints = self.session.toggle_hints()
+        self.redraw_trigger()
     
     def update(self, dt):
-        if self.game_over:
+        if not self.playing:
             return
-        
-        self.last_fall_time += dt
-        if self.last_fall_time > self.fall_speed:
-            if not self.move(0, 1):
-                self.lock_piece()
-            self.last_fall_time = 0
+        profiler = self.profiler
+        if profiler:
+            profiler.start_frame()
+        
+        # Spend the elapsed time in fixed simulation ticks; leftover time
+        # stays in the accumulator for the next wake-up
+        ticks = self.sim_clock.advance()
+        self.session.advance(ticks)
+        if profiler:
+            profiler.mark('update')
+        
+        self.sync_state()
+        if self.playing:
+            self.schedule_gravity()
+        if profiler:
+            profiler.mark('sync')
+            profiler.end_frame()
+    
+    def redraw(self, *args):
+        profiler = self.profiler
+        if profiler:
+            profiler.start_frame()
         
         self.grid.draw()
         self.next_piece_widget.draw()
+        if profiler:
+            profiler.mark('draw')
+            profiler.end_frame()
+    
+    def update_profile_label(self, dt):
+        lines = [f'FPS {Clock.get_fps():.1f}'] + self.profiler.summary(frame_rate=False)
+        self.profile_label.text = '\n'.join(lines)
 
 class TetrisApp(App):
+    def __init__(self, record_dir=None, profile_path=None, scores_path=None, hint=False,
+                 replay_path=None, **kwargs):
+        super(TetrisApp, self).__init__(**kwargs)
+        self.record_dir = record_dir
+        self.replay_path = replay_path
+        self.hint = hint
+        self.profile_path = profile_path
+        # A startup probe never gets to a game over, so it keeps no results
+        self.scores_path = False if os.environ.get(STARTUP_PROBE) else scores_path
+        self.profiler = None
+        if profile_path:
+            from tetris_profile import FrameProfiler
+            self.profiler = FrameProfiler()
+    
+    def on_start(self):
+        if os.environ.get(STARTUP_PROBE):
+            Window.bind(on_flip=self.first_frame)
+        if self.replay_path:
+            # Straight to the game screen, playing the replay back
+            replay = Replay.load(self.replay_path)
+            self.root.get_screen('game').start_game(replay.level, replay)
+            self.root.current = 'game'
+    
+    def first_frame(self, *args):
+        Window.unbind(on_flip=self.first_frame)
+        print(f"first-frame {time.time():.6f}", flush=True)
+        self.stop()
+    
+    def on_stop(self):
+        self.root.get_screen('game').session.close()
+        if self.profiler:
+            self.profiler.dump(self.profile_path)
+    
     def build(self):
         # Create the screen manager
         sm = ScreenManager()
         
         # Add screens
         sm.add_widget(LevelSelectionScreen(name='level_selection'))
-        sm.add_widget(GameScreen(name='game'))
+        sm.add_widget(GameScreen(name='game', record_dir=self.record_dir, 
+                                 profiler=self.profiler, scores_path=self.scores_path, hint=self.hint))
         
         return sm
 
 if __name__ == '__main__':
-    TetrisApp().run()
+    # Kivy reads its own options first; ours follow a '--'
+    import argparse
+    parser = argparse.ArgumentParser(description="Tetris")
+    parser.add_argument('--record', metavar='DIR', 
+                        help="save a replay of every game to DIR")
+    parser.add_argument('--replay', metavar='FILE', 
+                        help="play back a recorded replay")
+    parser.add_argument('--profile', metavar='TRACE', nargs='?', const='tetris-trace.json', 
+                        help="show frame timings and write a trace file on exit")
+    parser.add_argument('--scores', metavar='FILE', 
+                        help="keep game results in this database (default: in the app's data directory)")
+    parser.add_argument('--hint', action='store_true', 
+                        help="outline the best placement for each piece (toggle with H)")
+    args = parser.parse_args()
+    TetrisApp(args.record, args.profile, args.scores, args.hint, args.replay).run()
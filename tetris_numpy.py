@@ -0,0 +1,133 @@
+import numpy as np
+
+from tetris_ai import DEFAULT_WEIGHTS
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, ROTATIONS
+
+# Batched board evaluation with NumPy, for heuristic tuning and analysis
+# runs that score many boards at a time. A batch is an array shaped
+# (batch, GRID_HEIGHT, GRID_WIDTH); any non-zero cell counts as filled, so
+# both grids of shape ids and boolean occupancy arrays work. Every function
+# handles the whole batch in a few array operations with no per-board
+# Python loop.
+#
+# NumPy is an optional dependency: only this module (and the benchmark that
+# times it) needs it.
+
+ROW_INDEX = np.arange(GRID_HEIGHT)
+COLUMN_BITS = 1 << np.arange(GRID_WIDTH)
+
+
+# Per-column lowest cell offsets of every piece orientation, as arrays
+BOTTOMS = tuple(tuple(np.array(rotation.bottoms) for rotation in orientations)
+                for orientations in ROTATIONS)
+
+
+def from_grids(grids):
+    return np.asarray(grids, dtype=np.uint8)
+
+
+def from_rows(rows):
+    # Boolean boards from bitboard rows, shaped (batch, GRID_HEIGHT)
+    rows = np.asarray(rows, dtype=np.int64)
+    return (rows[..., None] & COLUMN_BITS) != 0
+
+
+def to_rows(boards):
+    return (np.asarray(boards, dtype=bool) * COLUMN_BITS).sum(axis=2)
+
+
+def column_tops(boards):
+    # Row of each column's highest block, or GRID_HEIGHT if it is empty
+    filled = np.asarray(boards, dtype=bool)
+    return np.where(filled.any(axis=1), filled.argmax(axis=1), GRID_HEIGHT)
+
+
+def column_heights(boards):
+    return GRID_HEIGHT - column_tops(boards)
+
+
+def holes(boards, heights=None):
+    # Empty cells under a column's top block: every block of a column lies
+    # at or below its top, so that is the height minus the blocks in it
+    filled = np.asarray(boards, dtype=bool)
+    if heights is None:
+        heights = column_heights(filled)
+    return (heights - filled.sum(axis=1)).sum(axis=1)
+
+
+def bumpiness(heights):
+    return np.abs(np.diff(heights, axis=1)).sum(axis=1)
+
+
+def features(boards):
+    # Aggregate height, holes and bumpiness per board, as tetris_ai.features
+    heights = column_heights(boards)
+    return heights.sum(axis=1), holes(boards, heights), bumpiness(heights)
+
+
+def evaluate(boards, lines, weights=DEFAULT_WEIGHTS):
+    height, hole_count, bumps = features(boards)
+    return (weights['height'] * height + weights['lines'] * np.asarray(lines) +
+            weights['holes'] * hole_count + weights['bumpiness'] * bumps)
+
+
+def full_rows(boards):
+    # (batch, GRID_HEIGHT) mask of completed rows
+    return np.asarray(boards, dtype=bool).all(axis=2)
+
+
+def clear_full_rows(boards):
+    # Boards with completed rows removed and the rest shifted down, plus the
+    # number cleared per board. A stable sort moves full rows to the top
+    # without reordering the others; they are then emptied.
+    boards = np.asarray(boards)
+    full = full_rows(boards)
+    cleared = full.sum(axis=1)
+    order = np.argsort(~full, axis=1, kind='stable')
+    result = np.take_along_axis(boards, order[:, :, None], axis=1)
+    result[ROW_INDEX < cleared[:, None]] = 0
+    return result, cleared
+
+
+def drop_positions(boards, shape_index, rotation, x):
+    # Resting y for the piece hard dropped at column x onto every board from
+    # above the stack. A negative y means it does not fit (game over).
+    bottoms = BOTTOMS[shape_index][rotation]
+    tops = column_tops(boards)[:, x:x + len(bottoms)]
+    return (tops - 1 - bottoms).min(axis=1)
+
+
+def collides(boards, shape_index, rotation, x, y):
+    # Per-board collision check of the piece at (x, y); y may be an array
+    boards = np.asarray(boards, dtype=bool)
+    y = np.broadcast_to(y, len(boards))
+    batch = np.arange(len(boards))
+    hit = np.zeros(len(boards), dtype=bool)
+    for dx, dy in ROTATIONS[shape_index][rotation].cells:
+        column = x + dx
+        if column < 0 or column >= GRID_WIDTH:
+            return np.ones(len(boards), dtype=bool)
+        row = y + dy
+        outside = row >= GRID_HEIGHT
+        inside = (row >= 0) & ~outside
+        hit |= outside
+        hit[inside] |= boards[batch[inside], row[inside], column]
+    return hit
+
+
+def place(boards, shape_index, rotation, x, y):
+    # Copies of the boards with the piece locked at (x, y[i]); boards where
+    # y is negative are left unchanged
+    result = np.array(boards)
+    y = np.broadcast_to(y, len(result))
+    fits = np.flatnonzero(y >= 0)
+    for dx, dy in ROTATIONS[shape_index][rotation].cells:
+        result[fits, y[fits] + dy, x + dx] = shape_index + 1
+    return result
+
+
+def drop_and_place(boards, shape_index, rotation, x):
+    # Hard drop at column x, lock and clear: (boards, lines cleared, fits)
+    y = drop_positions(boards, shape_index, rotation, x)
+    placed, cleared = clear_full_rows(place(boards, shape_index, rotation, x, y))
+    return placed, cleared, y >= 0
@@ -0,0 +1,85 @@
+import json
+import time
+from collections import deque
+
+# Optional per-frame instrumentation for the front ends. A frame is split
+# into named phases with mark(); the profiler keeps a rolling window of
+# frame times for the live overlay and a bounded list of trace events that
+# dump() writes in Chrome's trace event format (open in chrome://tracing or
+# https://ui.perfetto.dev).
+#
+# Front ends only create a FrameProfiler when profiling is switched on and
+# guard every call with "if profiler", so a normal run pays nothing.
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FrameProfiler:
+    def __init__(self, history=600, max_events=200000):
+        self.frame_times = deque(maxlen=history)  # Start-to-start intervals
+        self.work_times = deque(maxlen=history)  # Time spent inside frames
+        self.phase_times = {}  # Phase name -> deque of durations
+        self.history = history
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.frame_start = None
+        self.last_mark = None
+
+    def start_frame(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append(now - self.frame_start)
+        self.frame_start = now
+        self.last_mark = now
+
+    def mark(self, phase):
+        # Close the phase that ran since the previous mark
+        now = time.perf_counter()
+        duration = now - self.last_mark
+        times = self.phase_times.get(phase)
+        if times is None:
+            times = self.phase_times[phase] = deque(maxlen=self.history)
+        times.append(duration)
+        self.events.append((phase, self.last_mark, duration))
+        self.last_mark = now
+
+    def end_frame(self):
+        self.work_times.append(self.last_mark - self.frame_start)
+
+    def fps(self):
+        if not self.frame_times:
+            return 0.0
+        return len(self.frame_times) / sum(self.frame_times)
+
+    def summary(self, frame_rate=True):
+        # Overlay text, one line per entry. Event-driven loops (Kivy) pass
+        # frame_rate=False since their callbacks are not frames.
+        ms = 1000
+        lines = []
+        if frame_rate:
+            lines.append(f"FPS {self.fps():.1f}")
+            lines.append(f"frame p50 {percentile(self.frame_times, 0.5) * ms:.1f} "
+                         f"p99 {percentile(self.frame_times, 0.99) * ms:.1f} ms")
+        lines.append(f"work p50 {percentile(self.work_times, 0.5) * ms:.2f} "
+                     f"p99 {percentile(self.work_times, 0.99) * ms:.2f} ms")
+        for phase, times in self.phase_times.items():
+            lines.append(f"{phase} p99 {percentile(times, 0.99) * ms:.2f} ms")
+        return lines
+
+    def dump(self, path):
+        us = 1000000
+        events = [{
+            'name': phase,
+            'ph': 'X',
+            'ts': round((start - self.origin) * us, 1),
+            'dur': round(duration * us, 1),
+            'pid': 0,
+            'tid': 0,
+        } for phase, start, duration in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,194 @@
+import struct
+import zlib
+from collections import namedtuple
+
+import tetris_core
+from tetris_core import PieceGenerator
+
+# Replay files hold the seed, piece mode and starting level of a game plus
+# the player's inputs as (tick, action) pairs. Re-simulating those inputs on
+# a fresh Game reproduces the whole session.
+#
+# Layout: a fixed header followed by one varint per event. Each varint packs
+# the ticks since the previous event with the action in the low 3 bits, so
+# most inputs cost a single byte. The stream ends with an END event whose
+# delta lands on the tick the recording stopped.
+#
+# After END comes the result the recording ended with: score, lines
+# cleared, pieces locked, ticks and a CRC-32 of which cells were filled, as
+# varints. ReplayPlayer.check() re-simulates a replay and compares, so saved
+# replays double as regression tests for the engine. Replays saved before
+# the result was added end at END and still load, without a result.
+
+MAGIC = b'TTRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBQ')  # magic, version, piece mode, level, seed
+
+END = 7  # Pseudo-action closing the event stream
+ACTION_BITS = 3
+
+ReplayResult = namedtuple('ReplayResult', 'score lines pieces ticks board')
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def result_of(game):
+    # Occupancy only, so a BitBoardGame's board hashes the same as a grid's
+    filled = bytes(1 if cell else 0 for row in game.grid for cell in row)
+    return ReplayResult(game.score, game.lines_cleared, game.pieces_locked, game.ticks,
+                        zlib.crc32(filled))
+
+
+class Replay:
+    def __init__(self, seed, level=1, piece_mode='uniform', events=None, end_tick=None, result=None):
+        self.seed = seed
+        self.level = level
+        self.piece_mode = piece_mode
+        self.events = events if events is not None else []
+        self.end_tick = end_tick
+        self.result = result
+
+    def to_bytes(self):
+        out = bytearray(HEADER.pack(MAGIC, VERSION,
+                                    PieceGenerator.MODES.index(self.piece_mode),
+                                    self.level, self.seed))
+        last_tick = 0
+        for tick, action in self.events:
+            encode_varint(((tick - last_tick) << ACTION_BITS) | action, out)
+            last_tick = tick
+        end_tick = self.end_tick if self.end_tick is not None else last_tick
+        encode_varint(((end_tick - last_tick) << ACTION_BITS) | END, out)
+        if self.result is not None:
+            for value in self.result:
+                encode_varint(value, out)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, mode, level, seed = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a Tetris replay")
+        if version != VERSION:
+            raise ValueError(f"Unsupported replay version: {version}")
+
+        events = []
+        tick = 0
+        pos = HEADER.size
+        while pos < len(data):
+            value, pos = decode_varint(data, pos)
+            tick += value >> ACTION_BITS
+            action = value & ((1 << ACTION_BITS) - 1)
+            if action == END:
+                result = None
+                if pos < len(data):
+                    values = []
+                    for _ in ReplayResult._fields:
+                        value, pos = decode_varint(data, pos)
+                        values.append(value)
+                    result = ReplayResult(*values)
+                return cls(seed, level, PieceGenerator.MODES[mode], events, tick, result)
+            events.append((tick, action))
+        raise ValueError("Truncated replay")
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class ReplayRecorder:
+    # Attach right after game.reset(); call record() for every input
+    def __init__(self, game):
+        self.game = game
+        self.replay = Replay(game.seed, game.level, game.piece_mode)
+
+    def record(self, action):
+        self.replay.events.append((self.game.ticks, action))
+
+    def finish(self):
+        self.replay.end_tick = self.game.ticks
+        self.replay.result = result_of(self.game)
+        return self.replay
+
+
+class ReplayPlayer:
+    # Re-simulates a replay, either all at once (run) or tick by tick in step
+    # with a front end's clock (advance). Pass a front end's game to play it
+    # back live; otherwise a headless core Game is used. The game takes the
+    # replay's piece mode until stop() gives it back its own.
+    def __init__(self, replay, game=None):
+        self.replay = replay
+        if game is None:
+            game = tetris_core.Game(replay.level, replay.seed, replay.piece_mode)
+            self.piece_mode = replay.piece_mode
+        else:
+            self.piece_mode = game.piece_mode
+            game.piece_mode = replay.piece_mode
+            game.reset(replay.level, replay.seed)
+        self.game = game
+        self.index = 0
+
+    @property
+    def finished(self):
+        # Inputs recorded on the last tick still have to be applied
+        return self.game.game_over or (self.game.ticks >= self.replay.end_tick and
+                                       self.index >= len(self.replay.events))
+
+    def advance(self, ticks):
+        # Run up to ticks simulation ticks, applying inputs as they come due
+        self.advance_to(min(self.game.ticks + ticks, self.replay.end_tick))
+
+    def advance_to(self, target):
+        game = self.game
+        events = self.replay.events
+        while not game.game_over:
+            # Inputs are applied before the tick that follows them
+            while self.index < len(events) and events[self.index][0] <= game.ticks:
+                game.apply(events[self.index][1])
+                self.index += 1
+            if game.ticks >= target or game.game_over:
+                break
+            game.step()
+
+    def stop(self):
+        # Done with the game: its next reset uses its own piece mode again
+        self.game.piece_mode = self.piece_mode
+
+    def run(self):
+        # Fast-forward to the end of the recording
+        self.advance_to(self.replay.end_tick)
+        return self.game
+
+    def check(self):
+        # Run, then compare with the result saved with the replay; raises
+        # ValueError naming whatever came out different
+        game = self.run()
+        expected = self.replay.result
+        if expected is None:
+            raise ValueError("Replay has no saved result")
+        different = [f"{field} {got} (recorded {wanted})" for field, wanted, got
+                     in zip(ReplayResult._fields, expected, result_of(game)) if wanted != got]
+        if different:
+            raise ValueError("Replay does not reproduce: " + ", ".join(different))
+        return game
@@ -0,0 +1,434 @@
+import argparse
+import asyncio
+import itertools
+import random
+import struct
+import sys
+import time
+from collections import deque
+
+import tetris_core
+from tetris_core import GRID_WIDTH, GRID_HEIGHT, TICK, TICK_RATE, ACTIONS, ROTATE, LEFT, RIGHT, DROP
+from tetris_profile import percentile
+from tetris_snapshot import SnapshotEncoder, GameMirror
+
+# Authoritative multiplayer server. One asyncio loop hosts any number of
+# sessions (solo, or versus for two players); a single ticker steps every
+# session's games at TICK_RATE, so adding a session costs a few game steps a
+# tick rather than a task and a timer of its own.
+#
+#   python3 tetris_server.py --port 7777
+#   python3 tetris_server.py --selftest 200     # 200 scripted clients over localhost
+#
+# Clients only send inputs; the server applies them on its next tick and
+# pushes back what changed. Both players of a versus session get the same
+# piece sequence, and clearing 2, 3 or 4 lines sends 1, 2 or 4 garbage rows
+# to the opponent, pushed up under their stack when their next piece locks.
+#
+# Wire format: every message is a 2-byte little-endian length and a payload
+# whose first byte is the message type.
+#
+#   client -> server  HELLO  mode (0 solo, 1 versus), start level
+#                     INPUT  action
+#   server -> client  START  session id, your player index, players, seed, level
+#                     FULL   player, a tetris_snapshot keyframe
+#                     DELTA  player, a tetris_snapshot delta
+#                     OVER   loser (255 for a solo game over), final scores
+
+HELLO, INPUT = 1, 2
+START, FULL, DELTA, OVER = 16, 17, 18, 19
+SOLO, VERSUS = 0, 1
+NOBODY = 255
+
+LENGTH = struct.Struct('<H')
+HELLO_MSG = struct.Struct('<BBB')  # type, mode, level
+INPUT_MSG = struct.Struct('<BB')  # type, action
+START_MSG = struct.Struct('<BIBBQB')  # type, session, player, players, seed, level
+STATE_HEAD = struct.Struct('<BB')  # type, player
+
+# Garbage rows sent for clearing 0-4 lines at once
+GARBAGE_LINES = (0, 0, 1, 2, 4)
+
+# A client that lets this much output pile up unread is dropped
+MAX_BUFFERED = 1 << 20
+
+# Inputs applied per player and tick, and inputs held back beyond that;
+# anything more a client sends is ignored
+INPUTS_PER_TICK = 4
+MAX_QUEUED_INPUTS = 64
+
+
+def frame(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+
+async def read_message(reader):
+    size, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(size)
+
+
+class Player:
+    def __init__(self, writer, session, index):
+        self.writer = writer
+        self.session = session
+        self.index = index
+        self.game = tetris_core.Game(session.level, session.seed, 'bag')
+        self.inputs = deque()
+        self.pending_garbage = 0
+        self.locked = 0  # pieces_locked when garbage was last checked
+        self.lines = self.game.lines_cleared
+        self.encoder = SnapshotEncoder(self.game)
+
+
+class Session:
+    def __init__(self, server, session_id, mode, level, seed):
+        self.server = server
+        self.id = session_id
+        self.mode = mode
+        self.level = level
+        self.seed = seed
+        self.random = random.Random(seed)  # Garbage gap columns
+        self.players = []
+        self.started = False
+        self.finished = False
+
+    def add_player(self, writer):
+        player = Player(writer, self, len(self.players))
+        self.players.append(player)
+        return player
+
+    def start(self):
+        self.started = True
+        for player in self.players:
+            self.send(player, START_MSG.pack(START, self.id, player.index, len(self.players),
+                                             self.seed, self.level))
+        for player in self.players:
+            self.broadcast(self.full_state(player))
+
+    def step(self, ticks):
+        for _ in range(ticks):
+            for player in self.players:
+                game = player.game
+                if game.game_over:
+                    continue
+                # Garbage is settled after every input and tick, so each
+                # lock's line clears are counted on their own
+                for _ in range(min(len(player.inputs), INPUTS_PER_TICK)):
+                    game.apply(player.inputs.popleft())
+                    self.exchange_garbage(player)
+                game.step()
+                self.exchange_garbage(player)
+            if any(player.game.game_over for player in self.players):
+                break
+        for player in self.players:
+            delta = self.delta_state(player)
+            if delta is not None:
+                self.broadcast(delta)
+        losers = [player.index for player in self.players if player.game.game_over]
+        if losers:
+            self.finish(losers[0] if self.mode == VERSUS else NOBODY)
+
+    def exchange_garbage(self, player):
+        game = player.game
+        if game.pieces_locked == player.locked:
+            return
+        player.locked = game.pieces_locked
+        cleared = game.lines_cleared - player.lines
+        player.lines = game.lines_cleared
+        if cleared and self.mode == VERSUS:
+            for other in self.players:
+                if other is not player:
+                    other.pending_garbage += GARBAGE_LINES[cleared]
+        if player.pending_garbage and not game.game_over:
+            game.add_garbage(min(player.pending_garbage, GRID_HEIGHT), self.random.randrange(GRID_WIDTH))
+            player.pending_garbage = 0
+
+    def full_state(self, player):
+        return STATE_HEAD.pack(FULL, player.index) + player.encoder.keyframe()
+
+    def delta_state(self, player):
+        # Only what changed since the last message about this player, or None
+        delta = player.encoder.delta()
+        return None if delta is None else STATE_HEAD.pack(DELTA, player.index) + delta
+
+    def finish(self, loser):
+        # The session stays listed, no longer ticking, until its players leave
+        self.finished = True
+        scores = b''.join(struct.pack('<I', player.game.score) for player in self.players)
+        self.broadcast(bytes((OVER, loser)) + scores)
+
+    def send(self, player, payload):
+        writer = player.writer
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            writer.close()
+            return
+        self.server.bytes_sent += LENGTH.size + len(payload)
+        writer.write(frame(payload))
+
+    def broadcast(self, payload):
+        for player in self.players:
+            self.send(player, payload)
+
+
+class GameServer:
+    def __init__(self, seed=None):
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.waiting = None  # Versus player waiting for an opponent
+        self.random = random.Random(seed)
+        self.clock = tetris_core.SimulationClock()
+        self.server = None
+        self.ticker = None
+        self.connections = set()  # Client handler tasks
+        self.bytes_sent = 0
+        self.ticks = 0
+        self.work_times = deque(maxlen=TICK_RATE * 60)  # Seconds spent per wakeup
+        self.lateness = deque(maxlen=TICK_RATE * 60)  # Seconds woken past schedule
+
+    async def start(self, host='127.0.0.1', port=7777):
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        self.clock.reset()
+        self.ticker = asyncio.get_running_loop().create_task(self.run_ticks())
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.ticker is not None:
+            self.ticker.cancel()
+        self.server.close()
+        # Hang up on every client and let the handlers finish
+        for session in self.sessions.values():
+            for player in session.players:
+                player.writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def run_ticks(self):
+        # One wakeup per tick for every session; a late wakeup runs the
+        # ticks that came due so game speed holds under load
+        loop = asyncio.get_running_loop()
+        target = loop.time()
+        while True:
+            target += TICK
+            delay = target - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            woke = loop.time()
+            self.lateness.append(max(0.0, woke - target))
+            ticks = self.clock.advance()
+            if ticks:
+                self.ticks += ticks
+                for session in list(self.sessions.values()):
+                    if session.started and not session.finished:
+                        session.step(ticks)
+            target = max(target, loop.time() - TICK)
+            self.work_times.append(loop.time() - woke)
+
+    def new_session(self, mode, level):
+        session_id = next(self.session_ids)
+        session = Session(self, session_id, mode, level, self.random.randrange(2 ** 32))
+        self.sessions[session_id] = session
+        return session
+
+    def end_session(self, session):
+        self.sessions.pop(session.id, None)
+
+    async def handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        player = None
+        try:
+            message = await read_message(reader)
+            if len(message) != HELLO_MSG.size or message[0] != HELLO:
+                return
+            _, mode, level = HELLO_MSG.unpack(message)
+            level = min(max(level, 1), 10)
+            if mode == VERSUS and self.waiting is not None and not self.waiting[1].is_closing():
+                session, _ = self.waiting
+                self.waiting = None
+                player = session.add_player(writer)
+                session.start()
+            elif mode == VERSUS:
+                session = self.new_session(VERSUS, level)
+                player = session.add_player(writer)
+                self.waiting = (session, writer)
+            else:
+                session = self.new_session(SOLO, level)
+                player = session.add_player(writer)
+                session.start()
+
+            while True:
+                message = await read_message(reader)
+                if (len(message) == INPUT_MSG.size and message[0] == INPUT and message[1] in ACTIONS and
+                        len(player.inputs) < MAX_QUEUED_INPUTS):
+                    player.inputs.append(message[1])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+            if player is not None:
+                session = player.session
+                # Leaving counts as losing
+                player.game.game_over = True
+                if self.waiting is not None and self.waiting[1] is writer:
+                    self.waiting = None
+                if all(other.writer.is_closing() for other in session.players):
+                    self.end_session(session)
+
+    def stats(self):
+        ms = 1000
+        return {
+            'sessions': len(self.sessions),
+            'ticks': self.ticks,
+            'work_p50_ms': percentile(self.work_times, 0.5) * ms,
+            'work_p99_ms': percentile(self.work_times, 0.99) * ms,
+            'late_p99_ms': percentile(self.lateness, 0.99) * ms,
+            'bytes_sent': self.bytes_sent,
+        }
+
+
+class ScriptedClient:
+    # Plays over a socket: mirrors the server's state and sends one input
+    # every input_ticks, either random moves or the autoplayer's plan
+    def __init__(self, mode=SOLO, level=1, policy='random', input_ticks=6, seed=0):
+        self.mode = mode
+        self.level = level
+        self.policy = policy
+        self.input_interval = input_ticks * TICK
+        self.random = random.Random(seed)
+        self.games = []
+        self.index = None
+        self.session_id = None
+        self.result = None
+        self.messages = 0
+        self.bytes_received = 0
+        self.started = asyncio.Event()
+        self.bot = None
+        if policy == 'bot':
+            from tetris_ai import AutoPlayer
+            self.bot = AutoPlayer(lookahead=False)
+        self.plan = []
+        self.plan_piece = None
+
+    async def run(self, host, port, duration):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(frame(HELLO_MSG.pack(HELLO, self.mode, self.level)))
+        receiver = asyncio.get_running_loop().create_task(self.receive(reader))
+        try:
+            await asyncio.wait_for(self.started.wait(), duration)
+            end = time.monotonic() + duration
+            while self.result is None and time.monotonic() < end and not receiver.done():
+                writer.write(frame(INPUT_MSG.pack(INPUT, self.next_action())))
+                await asyncio.sleep(self.input_interval)
+        except asyncio.TimeoutError:
+            pass
+        return reader, writer, receiver
+
+    async def receive(self, reader):
+        while True:
+            message = await read_message(reader)
+            self.messages += 1
+            self.bytes_received += LENGTH.size + len(message)
+            kind = message[0]
+            if kind == START:
+                _, self.session_id, self.index, players, _, _ = START_MSG.unpack(message)
+                self.games = [GameMirror() for _ in range(players)]
+                self.started.set()
+            elif kind in (FULL, DELTA):
+                self.games[message[1]].apply(message, STATE_HEAD.size)
+            elif kind == OVER:
+                self.result = message[1]
+                return
+
+    def next_action(self):
+        game = self.games[self.index]
+        if self.bot is None:
+            return self.random.choice((LEFT, RIGHT, ROTATE, ROTATE, DROP))
+        # Re-plan whenever a new piece shows up (the mirror swaps objects)
+        if self.plan_piece is not game.current_piece:
+            self.plan_piece = game.current_piece
+            placement = self.bot.best_placement(game)
+            self.plan = self.bot.actions(game, placement) if placement else [DROP]
+        return self.plan.pop(0) if self.plan else DROP
+
+
+async def selftest(clients, duration, versus, policy, level):
+    # Scripted clients against an in-process server over localhost; checks
+    # that every client's mirror matches the server and reports tick timing
+    server = GameServer(seed=0)
+    port = await server.start()
+    players = []
+    for i in range(clients):
+        mode = VERSUS if i < versus * 2 else SOLO
+        players.append(ScriptedClient(mode, level, policy, seed=i))
+    started = time.perf_counter()
+    connections = await asyncio.gather(*(client.run('127.0.0.1', port, duration) for client in players))
+
+    # Let the last ticks reach the clients, then compare with the server
+    ticker = server.ticker
+    server.ticker = None
+    ticker.cancel()
+    await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    mismatches = 0
+    for client in players:
+        session = server.sessions.get(client.session_id)
+        if session is None or not client.games:
+            continue
+        for player, mirror in zip(session.players, client.games):
+            game = player.game
+            if (mirror.grid != game.grid or mirror.score != game.score or
+                    (mirror.current_piece.x, mirror.current_piece.y) != (game.current_piece.x, game.current_piece.y)):
+                mismatches += 1
+    for reader, writer, receiver in connections:
+        receiver.cancel()
+        writer.close()
+    stats = server.stats()
+    playing = len(server.sessions)
+    await server.stop()
+
+    received = sum(client.bytes_received for client in players)
+    print(f"{clients} clients ({versus} versus pairs), {playing} sessions still playing")
+    print(f"{stats['ticks']} ticks in {elapsed:.1f} s; per tick work p50 {stats['work_p50_ms']:.2f} ms, "
+          f"p99 {stats['work_p99_ms']:.2f} ms; wakeup lateness p99 {stats['late_p99_ms']:.2f} ms")
+    print(f"{received / clients / elapsed:.0f} bytes/s per client, "
+          f"{sum(client.messages for client in players) / clients / elapsed:.1f} messages/s per client")
+    print(f"mirror mismatches: {mismatches}")
+    return mismatches == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris multiplayer server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--selftest', type=int, metavar='CLIENTS',
+                        help="run scripted clients against a local server and report")
+    parser.add_argument('--duration', type=float, default=10.0, help="self-test length in seconds")
+    parser.add_argument('--versus', type=int, default=None,
+                        help="versus pairs among the self-test clients (default: half the clients play versus)")
+    parser.add_argument('--policy', choices=('random', 'bot'), default='random',
+                        help="how self-test clients play")
+    parser.add_argument('--level', type=int, default=1, help="self-test start level")
+    args = parser.parse_args(argv)
+
+    if args.selftest:
+        versus = args.selftest // 4 if args.versus is None else args.versus
+        ok = asyncio.run(selftest(args.selftest, args.duration, versus, args.policy, args.level))
+        return 0 if ok else 1
+
+    async def serve():
+        server = GameServer()
+        port = await server.start(args.host, args.port)
+        print(f"Serving on {args.host}:{port}")
+        await asyncio.Event().wait()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import os
+import time
+
+from tetris_replay import ReplayPlayer, ReplayRecorder
+
+# Everything a front end does around one game besides drawing it: recording
+# a replay, playing one back, storing the result once the game is over and
+# searching hints in the background. tetris.py and tetris_kivy.py each keep
+# a Session for their game and call it from their own loop and input code.
+# The score store and the hint worker are only imported once they are
+# needed, so none of this is startup time.
+
+
+class Session:
+    def __init__(self, game, record_dir=None, scores_path=False, player_name='human',
+                 on_results=None, on_hint=None):
+        self.game = game
+        self.record_dir = record_dir
+        self.scores_path = scores_path  # False keeps no results, None uses ScoreStore's default
+        self.player_name = player_name
+        self.on_results = on_results  # Called with the results Future of each stored game
+        self.on_hint = on_hint  # Called from the worker thread when a hint is ready
+        self.scores = None  # ScoreStore, opened at the first game over
+        self.results = None  # Future of (top results, LevelStats) for the finished game
+        self.recorder = None
+        self.player = None  # ReplayPlayer while a replay is playing
+        self.hints = None  # HintWorker while hints are shown
+        self.hint_piece = None
+
+    def start(self, level, seed=None):
+        self.stop_replay()
+        self.game.reset(level, seed)
+        self.results = None
+        self.recorder = ReplayRecorder(self.game) if self.record_dir else None
+        self.request_hint()
+
+    def start_replay(self, replay):
+        self.stop_replay()
+        self.player = ReplayPlayer(replay, self.game)
+        self.results = None
+        self.recorder = None
+        self.request_hint()
+
+    def stop_replay(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
+
+    @property
+    def playing(self):
+        # A played back replay stops at its last recorded tick
+        return not self.game.game_over and (self.player is None or not self.player.finished)
+
+    def input(self, action):
+        # Live input is ignored while a replay is playing; True if it was
+        # passed on to the game
+        if self.player is not None or self.game.game_over:
+            return False
+        if self.recorder is not None:
+            self.recorder.record(action)
+        self.game.apply(action)
+        self.update()
+        return True
+
+    def advance(self, ticks):
+        if self.player is not None:
+            self.player.advance(ticks)
+        else:
+            self.game.advance(ticks)
+        self.update()
+
+    def update(self):
+        # After the game changed: finish it if it ended, or search a hint
+        # for a new piece
+        if not self.playing:
+            self.finish()
+        else:
+            self.request_hint()
+
+    def save_replay(self):
+        if self.recorder is None:
+            return
+        replay = self.recorder.finish()
+        self.recorder = None
+        os.makedirs(self.record_dir, exist_ok=True)
+        replay.save(os.path.join(self.record_dir, f"tetris-{int(time.time())}-{self.game.seed}.ttr"))
+
+    def finish(self):
+        # Game over: keep the replay and store the result, once per game.
+        # Played back replays are not new results.
+        self.save_replay()
+        if self.scores_path is False or self.player is not None or self.results is not None:
+            return
+        if self.scores is None:
+            # sqlite3 and the database file are left until a result needs them
+            from tetris_stats import ScoreStore
+            self.scores = ScoreStore(self.scores_path)
+        self.scores.record_game(self.game, self.player_name)
+        self.results = self.scores.results(self.game.start_level, self.player_name)
+        if self.on_results is not None:
+            self.on_results(self.results)
+
+    def toggle_hints(self):
+        # The worker thread only exists while hints are on
+        if self.hints is None:
+            from tetris_ai import HintWorker
+            self.hints = HintWorker(on_ready=self.on_hint)
+            self.hint_piece = None
+            self.request_hint()
+        else:
+            self.hints.close()
+            self.hints = None
+        return self.hints
+
+    def request_hint(self):
+        # New piece: search its placement in the background
+        game = self.game
+        if self.hints is not None and not game.game_over and self.hint_piece is not game.current_piece:
+            self.hint_piece = game.current_piece
+            self.hints.request(game)
+
+    def close(self):
+        self.stop_replay()
+        if self.hints is not None:
+            self.hints.close()
+            self.hints = None
+        if self.scores is not None:
+            self.scores.close()
+            self.scores = None
@@ -0,0 +1,178 @@
+import struct
+from itertools import chain
+
+import tetris_core
+from tetris_core import GRID_WIDTH, GRID_HEIGHT
+from tetris_replay import encode_varint, decode_varint
+
+# Compact binary game state for spectator streams, the multiplayer server
+# and replay archives. A keyframe holds the whole state; a delta holds only
+# what changed since the previous keyframe or delta from the same encoder,
+# so a stream is one keyframe followed by deltas, applied in order.
+#
+# Layout: a flags byte, then a varint tick (absolute in a keyframe, ticks
+# since the previous message in a delta), then the sections named by the
+# flags, in this order:
+#
+#   PIECE     shape | rotation << 3 | next shape << 5, x, y (signed bytes)
+#   COUNTERS  score, lines cleared, level, pieces locked (varints)
+#   ROWS      keyframe: every row; delta: a varint mask of the rows that
+#             follow, bottom row in bit 0, so low rows cost the fewest bytes
+#
+# Rows pack two 4-bit cells per byte (5 bytes a row, 100 for the board):
+# cells run from EMPTY through the seven shapes to GARBAGE. A moving piece
+# costs 5 bytes a tick and a lock about 15-25.
+
+KEYFRAME, PIECE, COUNTERS, ROWS, GAME_OVER = 1, 2, 4, 8, 16
+
+PIECE_STATE = struct.Struct('<Bbb')
+ROW_BYTES = GRID_WIDTH // 2
+BOTTOM = GRID_HEIGHT - 1
+
+# Byte -> its two cells, for decoding
+NIBBLES = tuple((byte >> 4, byte & 0xF) for byte in range(256))
+
+
+def pack_rows(rows):
+    cells = iter(chain.from_iterable(rows))
+    return bytes(a << 4 | b for a, b in zip(cells, cells))
+
+
+def unpack_rows(data, pos, count):
+    cells = list(chain.from_iterable(map(NIBBLES.__getitem__, data[pos:pos + count * ROW_BYTES])))
+    return [cells[i:i + GRID_WIDTH] for i in range(0, count * GRID_WIDTH, GRID_WIDTH)]
+
+
+def piece_of(game):
+    piece = game.current_piece
+    return (piece.shape_index | piece.rotation << 3 | game.next_piece.shape_index << 5,
+            piece.x, piece.y)
+
+
+def counters_of(game):
+    return (game.score, game.lines_cleared, game.level, game.pieces_locked)
+
+
+class SnapshotEncoder:
+    # Encodes one game's state for a stream, remembering what was last sent
+    def __init__(self, game):
+        self.game = game
+        self.tick = 0
+        self.rows = None
+        self.piece = None
+        self.counters = None
+        self.game_over = False
+
+    def keyframe(self):
+        game = self.game
+        self.tick = game.ticks
+        self.rows = [row[:] for row in game.grid]
+        self.piece = piece_of(game)
+        self.counters = counters_of(game)
+        self.game_over = game.game_over
+        out = bytearray((KEYFRAME | PIECE | COUNTERS | ROWS | (GAME_OVER if game.game_over else 0),))
+        encode_varint(self.tick, out)
+        out += PIECE_STATE.pack(*self.piece)
+        for value in self.counters:
+            encode_varint(value, out)
+        out += pack_rows(self.rows)
+        return bytes(out)
+
+    def delta(self):
+        # Changes since the last keyframe or delta, or None if there are none
+        game = self.game
+        flags = 0
+        piece = piece_of(game)
+        if piece != self.piece:
+            flags |= PIECE
+            self.piece = piece
+        counters = counters_of(game)
+        if counters != self.counters:
+            flags |= COUNTERS
+            self.counters = counters
+        changed = []
+        sent = self.rows
+        if game.grid != sent:
+            # Bottom row first, matching the mask's bit order
+            for y in range(BOTTOM, -1, -1):
+                row = game.grid[y]
+                if row != sent[y]:
+                    changed.append(y)
+                    sent[y] = row[:]
+            flags |= ROWS
+        if game.game_over and not self.game_over:
+            flags |= GAME_OVER
+            self.game_over = True
+        if not flags:
+            return None
+
+        out = bytearray((flags,))
+        encode_varint(game.ticks - self.tick, out)
+        self.tick = game.ticks
+        if flags & PIECE:
+            out += PIECE_STATE.pack(*piece)
+        if flags & COUNTERS:
+            for value in counters:
+                encode_varint(value, out)
+        if changed:
+            encode_varint(sum(1 << (BOTTOM - y) for y in changed), out)
+            out += pack_rows(sent[y] for y in changed)
+        return bytes(out)
+
+
+class GameMirror:
+    # A game's state rebuilt from a stream of keyframes and deltas. Looks
+    # enough like tetris_core.Game to draw or to hand to the autoplayer.
+    def __init__(self):
+        self.grid = tetris_core.empty_grid()
+        self.current_piece = tetris_core.Tetrimino(0, 0, 0)
+        self.next_piece = tetris_core.Tetrimino(0, 0, 0)
+        self.score = 0
+        self.lines_cleared = 0
+        self.level = 1
+        self.pieces_locked = 0
+        self.ticks = 0
+        self.game_over = False
+
+    def apply(self, data, pos=0):
+        # Apply one message starting at pos; returns the position after it
+        flags = data[pos]
+        value, pos = decode_varint(data, pos + 1)
+        self.ticks = value if flags & KEYFRAME else self.ticks + value
+        piece = None
+        if flags & PIECE:
+            piece = PIECE_STATE.unpack_from(data, pos)
+            pos += PIECE_STATE.size
+        pieces_locked = self.pieces_locked
+        if flags & COUNTERS:
+            self.score, pos = decode_varint(data, pos)
+            self.lines_cleared, pos = decode_varint(data, pos)
+            self.level, pos = decode_varint(data, pos)
+            pieces_locked, pos = decode_varint(data, pos)
+        if flags & KEYFRAME or pieces_locked != self.pieces_locked:
+            # Every lock spawns a piece. Like the real game, the next piece
+            # object moves up and a new one takes its place, so a spawn is
+            # a new current_piece even when no PIECE was sent because the
+            # spawned piece matches the last one exactly.
+            previous, spawned = self.current_piece, self.next_piece
+            self.next_piece = tetris_core.Tetrimino(GRID_WIDTH // 2 - 1, 0, spawned.shape_index)
+            spawned.shape_index, spawned.rotation, spawned.x, spawned.y = \
+                previous.shape_index, previous.rotation, previous.x, previous.y
+            self.current_piece = spawned
+        if piece is not None:
+            packed, x, y = piece
+            current = self.current_piece
+            current.shape_index, current.rotation, current.x, current.y = packed & 7, packed >> 3 & 3, x, y
+            self.next_piece.shape_index = packed >> 5
+        self.pieces_locked = pieces_locked
+        if flags & KEYFRAME:
+            self.grid = unpack_rows(data, pos, GRID_HEIGHT)
+            pos += GRID_HEIGHT * ROW_BYTES
+        elif flags & ROWS:
+            mask, pos = decode_varint(data, pos)
+            changed = [BOTTOM - bit for bit in range(GRID_HEIGHT) if mask >> bit & 1]
+            for y, row in zip(changed, unpack_rows(data, pos, len(changed))):
+                self.grid[y] = row
+            pos += len(changed) * ROW_BYTES
+        self.game_over = bool(flags & GAME_OVER) or (self.game_over and not flags & KEYFRAME)
+        return pos
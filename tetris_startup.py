@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from tetris_bench import metadata
+
+# Cold-start benchmark for the two entry points.
+#
+#   python3 tetris_startup.py                  # pygame build
+#   python3 tetris_startup.py --target main.py  # kivy build
+#   python3 tetris_startup.py --output startup.json --compare old.json
+#
+# Every run starts a fresh interpreter with -X importtime and the startup
+# probe variable set, so the entry point exits as soon as its first frame is
+# on screen and prints the wall time. Reports the median time to first frame
+# and the slowest imports.
+
+TARGETS = ('tetris.py', 'main.py')
+PROBE = 'TETRIS_STARTUP_PROBE'
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def run_once(target):
+    # (seconds to first frame, {top-level module: cumulative seconds})
+    env = dict(os.environ, **{PROBE: '1'})
+    env.setdefault('SDL_VIDEODRIVER', 'dummy')
+    env.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.time()
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(here, target)],
+                            capture_output=True, text=True, cwd=here, env=env)
+    first_frame = None
+    for line in result.stdout.splitlines():
+        if line.startswith('first-frame '):
+            first_frame = float(line.split()[1]) - start
+    if first_frame is None:
+        raise RuntimeError(f"{target} exited without drawing a frame:\n{result.stderr[-2000:]}")
+
+    # Modules imported directly by the interpreter or the script (nested
+    # imports are indented further); their cumulative time includes
+    # everything they pull in
+    imports = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            imports[match.group(4)] = int(match.group(2)) / 1000000
+    return first_frame, imports
+
+
+def run(target, runs):
+    frames = []
+    imports = {}
+    for _ in range(runs):
+        first_frame, modules = run_once(target)
+        frames.append(first_frame)
+        for name, seconds in modules.items():
+            imports.setdefault(name, []).append(seconds)
+    return {
+        'meta': dict(metadata(), target=target, runs=runs),
+        'first_frame': {'median': statistics.median(frames), 'min': min(frames), 'max': max(frames)},
+        'imports': {name: statistics.median(times) for name, times in imports.items()},
+    }
+
+
+def report(data, baseline=None, top=12):
+    ms = 1000
+    frame = data['first_frame']
+    line = (f"time to first frame  median {frame['median'] * ms:7.1f} ms  "
+            f"(min {frame['min'] * ms:.1f}, max {frame['max'] * ms:.1f})")
+    if baseline is not None:
+        old = baseline['first_frame']['median']
+        line += f"  ({frame['median'] / old:.2f}x vs {baseline['meta'].get('commit')})"
+    print(line)
+    imports = sorted(data['imports'].items(), key=lambda item: -item[1])
+    print(f"imports              total  {sum(seconds for _, seconds in imports) * ms:7.1f} ms")
+    for name, seconds in imports[:top]:
+        print(f"  {name:30} {seconds * ms:8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris cold-start benchmark")
+    parser.add_argument('--target', choices=TARGETS, default='tetris.py')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', metavar='FILE', help="write results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="show the ratio against an earlier JSON run")
+    args = parser.parse_args(argv)
+
+    data = run(args.target, args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(data, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from tetris_core import TICK_RATE
+
+# Persistent results of finished games plus per-starting-level statistics,
+# kept in SQLite.
+#
+#   python3 tetris_stats.py top --level 5
+#   python3 tetris_stats.py import games.jsonl --player bot
+#
+# One worker thread owns the database connection, so a front end never
+# waits on disk: record() only queues a result, and results() returns a
+# Future the results screen can poll from its draw loop. The worker commits
+# everything queued at once in a single transaction, then answers queries,
+# so a query sees every result recorded before it.
+#
+# Top-N queries walk an index on (player, starting level, score), and the
+# per-level totals are kept up to date by a trigger on every insert, so the
+# results screen costs the same with ten games stored or a million.
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.tetris', 'scores.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    played_at REAL NOT NULL,
+    player TEXT NOT NULL,
+    start_level INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    lines INTEGER NOT NULL,
+    pieces INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    seed INTEGER
+);
+CREATE INDEX IF NOT EXISTS games_leaderboard ON games (player, start_level, score DESC);
+CREATE TABLE IF NOT EXISTS level_stats (
+    player TEXT NOT NULL,
+    start_level INTEGER NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    best_score INTEGER NOT NULL DEFAULT 0,
+    total_score INTEGER NOT NULL DEFAULT 0,
+    total_lines INTEGER NOT NULL DEFAULT 0,
+    total_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (player, start_level)
+);
+CREATE TRIGGER IF NOT EXISTS games_level_stats AFTER INSERT ON games BEGIN
+    INSERT OR IGNORE INTO level_stats (player, start_level) VALUES (NEW.player, NEW.start_level);
+    UPDATE level_stats SET games = games + 1,
+                           best_score = MAX(best_score, NEW.score),
+                           total_score = total_score + NEW.score,
+                           total_lines = total_lines + NEW.lines,
+                           total_seconds = total_seconds + NEW.seconds
+        WHERE player = NEW.player AND start_level = NEW.start_level;
+END;
+"""
+
+INSERT = """INSERT INTO games (played_at, player, start_level, level, score, lines, pieces, seconds, seed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+TOP = """SELECT played_at, player, start_level, level, score, lines, pieces, seconds, seed FROM games
+         WHERE player = ? AND start_level = ? ORDER BY score DESC LIMIT ?"""
+LEVEL_STATS = """SELECT games, best_score, total_score, total_lines, total_seconds FROM level_stats
+                 WHERE player = ? AND start_level = ?"""
+
+GameResult = namedtuple('GameResult', 'played_at player start_level level score lines pieces seconds seed')
+LevelStats = namedtuple('LevelStats', 'games best_score mean_score mean_lines mean_seconds')
+
+# A results() request waiting in the queue
+_Query = namedtuple('_Query', 'future player start_level count')
+
+
+def result_of(game, player='human'):
+    return GameResult(time.time(), player, game.start_level, game.level, game.score,
+                      game.lines_cleared - (game.start_level - 1) * 10, game.pieces_locked,
+                      game.ticks / TICK_RATE, game.seed)
+
+
+class ScoreStore:
+    def __init__(self, path=None, batch_size=1000):
+        self.path = path or DEFAULT_PATH
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='score-store', daemon=True)
+        self.thread.start()
+
+    def record(self, result):
+        self.queue.put(result)
+
+    def record_game(self, game, player='human'):
+        self.record(result_of(game, player))
+
+    def results(self, start_level, player='human', count=5):
+        # Future of (top count results, LevelStats or None) for a results screen
+        future = Future()
+        self.queue.put(_Query(future, player, start_level, count))
+        return future
+
+    def close(self):
+        # Commits whatever is still queued
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        # sqlite3 is imported here, so its import is off the startup path too
+        import sqlite3
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as error:
+            print(f"Could not open score database {self.path}: {error}", file=sys.stderr)
+            self.fail(error)
+            return
+        running = True
+        while running:
+            # Everything queued by now goes into one transaction
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            results = [item for item in items if isinstance(item, GameResult)]
+            if results:
+                try:
+                    with connection:
+                        connection.executemany(INSERT, results)
+                except sqlite3.Error as error:
+                    print(f"Could not save {len(results)} game results: {error}", file=sys.stderr)
+            for item in items:
+                if item is None:
+                    running = False
+                elif isinstance(item, _Query):
+                    try:
+                        item.future.set_result(self.query(connection, item))
+                    except sqlite3.Error as error:
+                        item.future.set_exception(error)
+        connection.close()
+
+    def fail(self, error):
+        # No database: results are dropped and every query, queued or still
+        # to come, fails with the error, until close()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, _Query):
+                item.future.set_exception(error)
+
+    @staticmethod
+    def query(connection, query):
+        top = [GameResult(*row) for row in
+               connection.execute(TOP, (query.player, query.start_level, query.count))]
+        row = connection.execute(LEVEL_STATS, (query.player, query.start_level)).fetchone()
+        stats = None
+        if row is not None:
+            games, best, score, lines, seconds = row
+            stats = LevelStats(games, best, score / games, lines / games, seconds / games)
+        return top, stats
+
+
+def import_games(store, path, player):
+    # Per-game JSON lines written by tetris_batch.py --output
+    count = 0
+    with open(path) as f:
+        for line in f:
+            game = json.loads(line)
+            level = game['level']
+            store.record(GameResult(time.time(), player, level, level + game['lines'] // 10,
+                                    game['score'], game['lines'], game['pieces'],
+                                    game['survival'], game['seed']))
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris high scores and statistics")
+    parser.add_argument('--scores', metavar='FILE', default=DEFAULT_PATH, help="score database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    top = commands.add_parser('top', help="print the best games for a starting level")
+    top.add_argument('--level', type=int, default=1)
+    top.add_argument('--player', default='human')
+    top.add_argument('--count', type=int, default=10)
+    load = commands.add_parser('import', help="add games from tetris_batch.py --output")
+    load.add_argument('games')
+    load.add_argument('--player', default='bot')
+    args = parser.parse_args(argv)
+
+    store = ScoreStore(args.scores)
+    start = time.perf_counter()
+    if args.command == 'import':
+        count = import_games(store, args.games, args.player)
+        store.close()
+        print(f"imported {count} games in {time.perf_counter() - start:.1f} s")
+        return 0
+
+    top, stats = store.results(args.level, args.player, args.count).result()
+    elapsed = time.perf_counter() - start
+    store.close()
+    for rank, game in enumerate(top, 1):
+        print(f"{rank:3}. {game.score:8} points {game.lines:5} lines  level {game.start_level}-{game.level}  "
+              f"{game.seconds / 60:5.1f} min  {time.strftime('%Y-%m-%d %H:%M', time.localtime(game.played_at))}")
+    if stats is not None:
+        print(f"{stats.games} games from level {args.level}: best {stats.best_score}, "
+              f"mean score {stats.mean_score:.0f}, mean lines {stats.mean_lines:.1f}, "
+              f"mean {stats.mean_seconds / 60:.1f} min")
+    print(f"query took {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())